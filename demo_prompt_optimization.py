@@ -6,7 +6,11 @@ import os
 import json
 import logging
 from typing import List
+from dspy.teleprompt import BootstrapFewShot
+from utils.lm_cache import CachedModule, LMCache
 from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
+from utils.program_registry import ProgramRegistry
 
 def setup_dspy(logger):
     """設置 dspy"""
@@ -22,6 +26,9 @@ def setup_dspy(logger):
     lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=400)
     dspy.configure(lm=lm)
     logger.log_info("✅ dspy 已配置完成")
+    
+    # 記錄每次 LM 呼叫的模型、token 數與延遲
+    return track_lm_usage(logger)
 
 class RetirementRisk(dspy.Signature):
     """評估退休風險並提供建議"""
@@ -94,8 +101,8 @@ def test_basic_version(logger):
     print("🧪 第二步: 測試基礎版本 (dspy.Predict)")
     print("="*80)
     
-    # 創建基礎預測器
-    basic_predictor = dspy.Predict(RetirementRisk)
+    # 創建基礎預測器；相同的 prompt 直接由本機 LM 快取回答
+    basic_predictor = CachedModule(dspy.Predict(RetirementRisk), LMCache(), logger=logger, name="basic_predict")
     
     test_case = {
         "age": 35,
@@ -143,7 +150,8 @@ def test_chain_of_thought(logger):
     print("="*80)
     
     # 創建 ChainOfThought 預測器
-    cot_predictor = dspy.ChainOfThought(RetirementRisk)
+    cot_predictor = CachedModule(dspy.ChainOfThought(RetirementRisk), LMCache(), logger=logger,
+                                 name="chain_of_thought")
     
     test_case = {
         "age": 35,
@@ -264,11 +272,11 @@ def test_optimized_version(logger):
     # 準備訓練範例
     examples = create_training_examples(logger)
     
-    # 創建基礎模組
-    base_module = dspy.ChainOfThought(RetirementRisk)
+    trainset = [ex.with_inputs("age", "savings", "monthly_income", "target_retirement_age") for ex in examples]
     
-    # 簡化版優化（模擬 Few-Shot 效果）
-    print(f"\n⚡ 模擬 Few-Shot 學習效果...")
+    # 評估指標：風險等級正確即可
+    def risk_level_metric(example, prediction, trace=None):
+        return example.risk_level in str(getattr(prediction, "risk_level", ""))
     
     test_case = {
         "age": 35,
@@ -280,10 +288,20 @@ def test_optimized_version(logger):
     logger.log_parameters(test_case, step="few_shot_optimized")
     
     try:
+        # 以 BootstrapFewShot 編譯；programs/ 中已有同簽名的編譯結果時直接載入，不重新編譯
+        print(f"\n⚡ 編譯 Few-Shot 優化版本 (已編譯過則直接載入)...")
+        optimizer = BootstrapFewShot(metric=risk_level_metric, max_bootstrapped_demos=2, max_labeled_demos=3)
+        optimized_module = ProgramRegistry().get_or_compile(
+            "retirement_risk",
+            dspy.ChainOfThought(RetirementRisk),
+            lambda program: optimizer.compile(program, trainset=trainset),
+            metadata={"optimizer": "BootstrapFewShot", "trainset": len(trainset)}
+        )
+        
         print("\n⏳ 執行優化版本...")
-        # 這裡我們用 ChainOfThought 來模擬優化效果
-        # 實際的 BootstrapFewShot 會需要更複雜的設置
-        optimized_result = base_module(**test_case)
+        # 編譯的是未包裝的模組，快取只包在編譯後的模組外
+        optimized_predictor = CachedModule(optimized_module, LMCache(), logger=logger, name="few_shot_optimized")
+        optimized_result = optimized_predictor(**test_case)
         
         # 記錄結果到日誌
         result_data = {
@@ -424,15 +442,18 @@ def main():
     
     try:
         # 設置環境
-        setup_dspy(logger)
+        tracker = setup_dspy(logger)
         
         # 展示基礎結構
         show_basic_prompt_structure(logger)
         
         # 測試三種版本
-        basic_result = test_basic_version(logger)
-        cot_result = test_chain_of_thought(logger)
-        optimized_result = test_optimized_version(logger)
+        with tracker.step("basic_predict"):
+            basic_result = test_basic_version(logger)
+        with tracker.step("chain_of_thought"):
+            cot_result = test_chain_of_thought(logger)
+        with tracker.step("few_shot_optimized"):
+            optimized_result = test_optimized_version(logger)
         
         # 對比結果
         compare_results(logger, basic_result, cot_result, optimized_result)
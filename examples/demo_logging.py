@@ -73,7 +73,7 @@ def demo_logging_system():
                         output = entry['output']
                         print(f"   - 破產機率: {output['bankruptcy_probability']:.2f}%")
                         print(f"   - 符合目標: {'是' if output['meets_goal'] else '否'}")
-                        print(f"   - 平均最終餘額: TWD {output['final_balance_mean']:,.0f}")
+                        print(f"   - 平均最終餘額: TWD {output.get('mean_end_balance', output.get('final_balance_mean')):,.0f}")
                     
                     print("\n5. 錯誤記錄:")
                     if entry['errors']:
@@ -3,6 +3,14 @@
 """
 import dspy
 import os
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.lm_cache import CachedModule, LMCache
+from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
+from utils.program_registry import ProgramRegistry
 
 # 設定 API key
 os.environ['OPENAI_API_KEY'] = os.getenv("OPENAI_API_KEY", "")
@@ -87,13 +95,18 @@ def demonstrate_optimization():
         print("export OPENAI_API_KEY='your-key-here'\n")
         return
     
+    logger = get_logger()
+    logger.start_query("dspy optimization demo", source="demo")
+    
     try:
-        # 配置語言模型
+        # 配置語言模型；每次 LM 呼叫記入 logs/ 的本次執行紀錄
         lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=300)
         dspy.configure(lm=lm)
+        tracker = track_lm_usage(logger)
         
-        # 創建基礎模組
+        # 創建基礎模組（相同提問從本機 LM 快取回答，重跑示範不再重複呼叫 API）
         advisor = FinancialAdvisor()
+        cache = LMCache()
         
         # 測試未優化版本
         print("1. 未優化版本測試：")
@@ -106,7 +119,7 @@ def demonstrate_optimization():
             "annual_spend": 1100000.0
         }
         
-        result = advisor(**test_case)
+        result = CachedModule(advisor, cache)(**test_case)
         print(f"輸入: 破產率={test_case['bankruptcy_prob']}%, 退休年數={test_case['years_to_retire']}")
         print(f"結果: 風險評估={result.risk_assessment}")
         print(f"建議: {result.recommendations}")
@@ -132,24 +145,40 @@ def demonstrate_optimization():
             max_labeled_demos=3
         )
         
-        # 編譯優化版本
+        # 編譯優化版本；已編譯且簽名未變時直接從 programs/ 載入，不重新編譯
         train_examples = create_training_examples()
-        compiled_advisor = optimizer.compile(
-            advisor,
-            trainset=train_examples[:2],  # 使用前兩個作為訓練
-            valset=train_examples[2:]     # 最後一個作為驗證
+        registry = ProgramRegistry()
+        compiled_advisor = registry.get_or_compile(
+            "financial_advisor",
+            FinancialAdvisor(),
+            lambda program: optimizer.compile(
+                program,
+                trainset=train_examples[:2],  # 使用前兩個作為訓練
+                valset=train_examples[2:]     # 最後一個作為驗證
+            ),
+            metadata={"optimizer": "BootstrapFewShot", "trainset": 2}
         )
         
         # 測試優化版本
         print("優化後測試相同案例：")
-        optimized_result = compiled_advisor(**test_case)
+        optimized_result = CachedModule(compiled_advisor, cache)(**test_case)
         print(f"優化後風險評估: {optimized_result.risk_assessment}")
         print(f"優化後建議: {optimized_result.recommendations}")
         print(f"優化後信心分數: {optimized_result.confidence_score}")
+        print(f"LM 快取: {cache.stats()}")
         
+        # 各步驟的 LM 用量（編譯時的 bootstrap 呼叫也算在內）
+        usage = tracker.summary()
+        print(f"LM 呼叫: {usage['calls']} 次, {usage['total_tokens']} tokens, {usage['latency_ms']['total']:.0f}ms")
+        for step, stats in usage["by_step"].items():
+            print(f"  {step}: {stats['calls']} 次, {stats['total_tokens']} tokens, {stats['latency_ms']['total']:.0f}ms")
+    
     except Exception as e:
+        logger.log_error(f"優化示範失敗: {e}", "optimization")
         print(f"執行時發生錯誤: {e}")
         print("請確保已正確設定 OPENAI_API_KEY")
+    finally:
+        logger.save_entry()
 
 
 # 5. 展示 Prompt 比較
@@ -8,6 +8,9 @@ from pathlib import Path
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
+from utils.program_registry import ProgramRegistry
 
 def setup_dspy():
     """設置 dspy 環境"""
@@ -24,6 +27,9 @@ def setup_dspy():
     lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=500)
     dspy.configure(lm=lm)
     print("✅ dspy 環境已設置完成\n")
+    
+    # 記錄每次 LM 呼叫的模型、token 數與延遲
+    return track_lm_usage(get_logger())
 
 
 def demo_signature_to_prompt():
@@ -234,11 +240,17 @@ def demo_optimization_with_examples():
     
     print("🚀 開始優化過程...")
     
-    # 編譯優化版本
-    optimized_assessor = optimizer.compile(
-        basic_assessor,
-        trainset=training_examples[:3],  # 前 3 個作為訓練
-        valset=training_examples[3:]     # 最後 1 個作為驗證
+    # 編譯優化版本；programs/ 中已有同簽名的編譯結果時直接載入
+    registry = ProgramRegistry()
+    optimized_assessor = registry.get_or_compile(
+        "retirement_risk_assessor",
+        dspy.ChainOfThought(RetirementRisk),
+        lambda program: optimizer.compile(
+            program,
+            trainset=training_examples[:3],  # 前 3 個作為訓練
+            valset=training_examples[3:]     # 最後 1 個作為驗證
+        ),
+        metadata={"optimizer": "BootstrapFewShot", "trainset": 3}
     )
     
     print("✅ 優化完成!")
@@ -424,6 +436,8 @@ def main():
     print("=" * 60)
     
     # 設置環境
+    logger = get_logger()
+    logger.start_query("dspy prompt engineering demo", source="demo")
     setup_dspy()
     
     # 1. 基礎轉換
@@ -454,6 +468,9 @@ def main():
     print(f"- 原始記錄: logs/session_*.jsonl")
     print(f"- 視覺化: logs/demo_*.png") 
     print(f"- 完整報告: logs/demo_full_report/")
+    
+    # 保存本次執行的 LM 用量紀錄
+    logger.save_entry()
 
 
 if __name__ == "__main__":
@@ -3,6 +3,12 @@
 """
 import dspy
 import os
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
 
 def setup_dspy():
     """設置 dspy"""
@@ -16,6 +22,9 @@ def setup_dspy():
     
     lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=300)
     dspy.configure(lm=lm)
+    
+    # 記錄每次 LM 呼叫的模型、token 數與延遲
+    return track_lm_usage(get_logger())
 
 def inspect_signature_conversion():
     """檢視 Signature 如何轉換為 prompt"""
@@ -279,6 +288,9 @@ def main():
     print("🔍 dspy Prompt 內部機制深度剖析")
     print("=" * 60)
     
+    logger = get_logger()
+    logger.start_query("inspect dspy prompts demo", source="demo")
+    
     # 展示各個方面
     signature = inspect_signature_conversion()
     demonstrate_prompt_generation()
@@ -305,6 +317,9 @@ def main():
     print("5. 🔄 持續迭代 - 不斷改進和優化")
     
     print(f"\n💡 記住: dspy 讓你專注於 '做什麼'，而不是 '怎麼做'！")
+    
+    # 保存本次執行的 LM 用量紀錄
+    logger.save_entry()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
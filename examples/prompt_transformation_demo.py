@@ -3,6 +3,12 @@ dspy Prompt 轉換和優化的實際展示
 """
 import dspy
 import os
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
 
 def setup_dspy():
     """設置 dspy"""
@@ -17,6 +23,9 @@ def setup_dspy():
     lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=300)
     dspy.configure(lm=lm)
     print("✅ dspy 已配置完成\n")
+    
+    # 記錄每次 LM 呼叫的模型、token 數與延遲
+    return track_lm_usage(get_logger())
 
 def demo_signature_transformation():
     """展示 Signature 到 Prompt 的轉換"""
@@ -311,6 +320,8 @@ def main():
     print("🎯 dspy Prompt 轉換和優化完整展示")
     print("=" * 60)
     
+    logger = get_logger()
+    logger.start_query("prompt transformation demo", source="demo")
     setup_dspy()
     
     # 展示各種轉換和優化
@@ -336,6 +347,9 @@ def main():
     print(f"2. 使用 BootstrapFewShot 進行實際優化")
     print(f"3. 分析優化前後的效果差異")
     print(f"4. 建立專屬的退休規劃 AI 助手")
+    
+    # 保存本次執行的 LM 用量紀錄
+    logger.save_entry()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
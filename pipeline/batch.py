@@ -0,0 +1,271 @@
+"""
+Concurrent batch parsing of natural-language queries with bounded parallelism and rate limiting
+
+Usage:
+    python pipeline/batch.py queries.txt --output parsed.jsonl --concurrency 16 --rate 20
+
+Input is one query per line, or JSONL with a "query" field. Output is one
+JSON line per query, in input order. Point --api-base at pipeline/stub_lm.py
+to exercise the batch path without a real LM.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import dspy
+
+# Add parent directory to path to import from utils and pipeline
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.run import PARAM_DEFAULTS, load_api_key, load_parser
+from utils.fast_parser import FIELDS, parse_query, resolve
+from utils.lm_cache import CachedModule, LMCache
+from utils.lm_usage import track_lm_usage
+
+# HTTP statuses and exception names worth retrying (rate limits, overload, network)
+_TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_TRANSIENT_NAMES = ("RateLimit", "Timeout", "Connection", "ServiceUnavailable", "InternalServer")
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` acquisitions per second on average, bursts up to ``capacity``."""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1.0, capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether an LM call error is worth retrying (rate limit, timeout, 5xx, dropped connection)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status in _TRANSIENT_STATUS:
+        return True
+    return any(name in type(error).__name__ for name in _TRANSIENT_NAMES)
+
+
+def parse_batch(queries: List[str], parser: Optional[Callable] = None, concurrency: int = 8,
+                rate: Optional[float] = None, burst: Optional[float] = None, max_retries: int = 3,
+                backoff: float = 0.5, fast_path: bool = True, cascade=None) -> List[Dict[str, Any]]:
+    """
+    Parse many queries concurrently, results in input order.
+    
+    Each query first goes through the rule-based fast path (see
+    utils.fast_parser); only queries with unresolved fields call ``parser``.
+    LM calls run on a pool of ``concurrency`` threads and pass a shared token
+    bucket first, so the batch never exceeds ``rate`` calls per second. A
+    call failing with a transient error is retried up to ``max_retries``
+    times after a full-jitter exponential backoff (uniform in
+    [0, backoff * 2**attempt]), which keeps retries from many threads from
+    arriving in lockstep. Other errors, and transient ones that outlast the
+    retries, are reported in the query's result rather than raised.
+    
+    Parameters:
+    -----------
+    queries : list of str
+        Natural-language queries
+    parser : callable, optional
+        Called as parser(query=...) and returning an object with the
+        QueryParser output fields; by default the cached pipeline.run.load_parser()
+        program on the configured dspy LM
+    concurrency : int, default=8
+        Maximum number of LM calls in flight
+    rate : float, optional
+        Maximum LM calls per second across all threads; unlimited if None
+    burst : float, optional
+        Token-bucket capacity (calls allowed back to back); defaults to rate
+    max_retries : int, default=3
+        Retries per query on transient errors
+    backoff : float, default=0.5
+        Base backoff in seconds
+    fast_path : bool, default=True
+        Try the rule-based parser before the LM
+    cascade : pipeline.cascade.ParserCascade, optional
+        Parse every query with ``cascade.parse`` instead of ``parser``. The
+        cascade runs its own fast path and validates every tier's parse
+        (check_params), so ``fast_path`` is not used. Rate-limit it by giving
+        the cascade a TokenBucket, which takes one token per LM tier call;
+        ``rate`` and ``burst`` are rejected here.
+    
+    Returns:
+    --------
+    list of dict
+        One per query, in order: "query", "params" (all QueryParser fields,
+        None on error), "source" ("fast_path" or "llm"; with a cascade, the
+        accepted tier, None if every tier was rejected), "unresolved"
+        (fields the LM supplied), "attempts" (LM calls made), "latency_ms"
+        and "error" (None on success). With a cascade, also "problems":
+        what check_params still objects to.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    if cascade is not None:
+        if parser is not None:
+            raise ValueError("pass either parser or cascade, not both")
+        if rate:
+            raise ValueError("rate-limit a cascade through its bucket, not rate")
+    if parser is None and cascade is None:
+        parser = CachedModule(load_parser(), LMCache(), name="QueryParser")
+    bucket = TokenBucket(rate, burst) if rate else None
+    
+    def parse_one(query: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = {"query": query, "params": None, "source": "fast_path", "unresolved": [],
+                  "attempts": 0, "latency_ms": None, "error": None}
+        if cascade is not None:
+            parse_cascaded(query, result)
+            result["latency_ms"] = (time.perf_counter() - started) * 1000
+            return result
+        if fast_path:
+            params, unresolved = resolve(parse_query(query))
+        else:
+            params, unresolved = {}, list(FIELDS)
+        
+        if unresolved:
+            result.update(source="llm", unresolved=unresolved)
+            for attempt in range(max_retries + 1):
+                if bucket is not None:
+                    bucket.acquire()
+                result["attempts"] += 1
+                try:
+                    parsed = parser(query=query)
+                except Exception as e:
+                    if attempt < max_retries and is_transient(e):
+                        time.sleep(random.uniform(0, backoff * 2 ** attempt))
+                        continue
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    break
+                for key in unresolved:
+                    params[key] = getattr(parsed, key, PARAM_DEFAULTS[key])
+                break
+        
+        if result["error"] is None:
+            result["params"] = {key: params[key] for key in FIELDS}
+        result["latency_ms"] = (time.perf_counter() - started) * 1000
+        return result
+    
+    def parse_cascaded(query: str, result: Dict[str, Any]):
+        # The cascade raises only transient errors; a retry repeats the tiers
+        # already answered from the LM cache
+        for attempt in range(max_retries + 1):
+            try:
+                parsed = cascade.parse(query)
+            except Exception as e:
+                result["attempts"] += 1
+                if attempt < max_retries and is_transient(e):
+                    time.sleep(random.uniform(0, backoff * 2 ** attempt))
+                    continue
+                result.update(source="llm", error=f"{type(e).__name__}: {e}")
+                return
+            lm_attempts = [tier for tier in parsed["attempts"] if tier["tier"] != "fast_path"]
+            result["attempts"] += len(lm_attempts)
+            result.update(params=parsed["params"], source=parsed["tier"], problems=parsed["problems"],
+                          unresolved=lm_attempts[0]["fields"] if lm_attempts else [])
+            return
+    
+    # map() yields results in input order regardless of completion order
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(parse_one, queries))
+
+
+def _read_queries(path: str) -> List[str]:
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse a file of retirement queries concurrently")
+    parser.add_argument("input", help="One query per line, or JSONL with a \"query\" field")
+    parser.add_argument("--output", help="JSONL output path (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, help="Max LM calls per second")
+    parser.add_argument("--burst", type=float, help="Token-bucket capacity")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--no-fast-path", action="store_true", help="Send every query to the LM")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Parse through pipeline/cascade.py: Predict on --model first, ChainOfThought on --strong-model only when validation fails")
+    parser.add_argument("--strong-model", default="openai/gpt-4o")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8765/v1 for pipeline/stub_lm.py")
+    args = parser.parse_args()
+    
+    if args.api_base:
+        lm = dspy.LM(model=args.model, api_base=args.api_base, api_key="stub", max_tokens=500, cache=False)
+    else:
+        if not load_api_key():
+            sys.exit(1)
+        lm = dspy.LM(model=args.model, max_tokens=500)
+    dspy.configure(lm=lm)
+    tracker = track_lm_usage()
+    cascade = None
+    if args.cascade:
+        # Every query goes through cascade.parse, which rate-limits each LM tier call itself
+        from pipeline.cascade import ParserCascade, default_tiers
+        cascade = ParserCascade(default_tiers(args.model, args.strong_model, args.api_base),
+                                fast_path=not args.no_fast_path, tracker=tracker,
+                                bucket=TokenBucket(args.rate, args.burst) if args.rate else None)
+    
+    queries = _read_queries(args.input)
+    started = time.perf_counter()
+    if cascade is not None:
+        results = parse_batch(queries, cascade=cascade, concurrency=args.concurrency, max_retries=args.retries)
+    else:
+        results = parse_batch(queries, concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                              max_retries=args.retries, fast_path=not args.no_fast_path)
+    elapsed = time.perf_counter() - started
+    
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if args.output:
+            out.close()
+    
+    failed = sum(result["error"] is not None for result in results)
+    via_llm = sum(result["source"] != "fast_path" for result in results)
+    print(f"Parsed {len(results)} queries in {elapsed:.1f}s: {len(results) - via_llm} by the fast path, "
+          f"{via_llm} via the LM ({sum(result['attempts'] for result in results)} calls), {failed} failed",
+          file=sys.stderr)
+    usage = tracker.summary()
+    print(f"LM usage: {usage['total_tokens']} tokens, latency p50 {usage['latency_ms']['p50']:.0f}ms "
+          f"p95 {usage['latency_ms']['p95']:.0f}ms, {usage['cache_hits']} dspy cache hits", file=sys.stderr)
+    if cascade is not None:
+        summary = cascade.summary()
+        print("Cascade: " + ", ".join(f"{name} {stats['accepted']}/{stats['attempts']} accepted"
+                                      for name, stats in summary["tiers"].items())
+              + f", {summary['rejected']} rejected by every tier", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
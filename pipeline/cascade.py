@@ -0,0 +1,322 @@
+"""
+Model cascade around QueryParser: cheap parse first, escalate only on validation failure
+
+Tiers run cheapest first: the rule-based fast path (utils.fast_parser), a
+(compiled, if saved) Predict(QueryParser) on a small model, then
+ChainOfThought(QueryParser) on a stronger one. After each tier the merged
+parameters go through check_params (types, ranges, spend implausibly far
+above net worth); a clean parse stops the cascade, otherwise only the fields
+implicated in the problems go to the next tier. Most queries stop at the
+first or second tier, so the expensive calls go to the few hard ones.
+
+Usage:
+    python pipeline/cascade.py [--corpus data/query_corpus.jsonl] [--api-base http://127.0.0.1:8765/v1]
+"""
+import argparse
+import contextlib
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import dspy
+
+# Add parent directory to path to import from utils and pipeline
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.batch import is_transient
+from pipeline.run import PARAM_DEFAULTS, QueryParser, load_api_key
+from utils.fast_parser import DEFAULT_CORPUS, FIELDS, parse_query, resolve
+from utils.lm_cache import CachedModule, LMCache
+from utils.logger import get_logger, summarize_cascade
+from utils.lm_usage import track_lm_usage
+from utils.program_registry import ProgramRegistry
+
+# Plausible range (inclusive) of each field; None leaves that side open
+PARAM_BOUNDS = {
+    'yrs': (1, 80),
+    'return_mu': (-20.0, 30.0),
+    'return_sigma': (0.0, 60.0),
+    'spend': (0.0, None),
+    'init_net': (0.0, None),
+    'inflation': (-5.0, 20.0),
+    'goal_pct': (0.0, 100.0)
+}
+
+# Annual spending above this multiple of net worth is taken for a unit slip (萬 parsed
+# as 元 is off by 10,000x). Spending more than the current net worth is a plan
+# that leans on future income, not a parse error, so the bound sits far above
+# 1x; an empty portfolio (init_net 0) is not checked.
+MAX_SPEND_RATIO = 100.0
+
+
+def check_params(params: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Coerce parsed parameters to numbers and list what makes them implausible.
+    
+    Parameters:
+    -----------
+    params : dict
+        QueryParser fields, possibly partial, as numbers or strings ("7%", "1,000,000")
+    
+    Returns:
+    --------
+    tuple
+        (values, problems): every field coerced (yrs as int, None where
+        missing or not a number), and one {"fields", "message"} per problem,
+        naming the fields a stronger tier should parse again
+    """
+    values, problems = {}, []
+    for field in FIELDS:
+        value = _number(params.get(field))
+        low, high = PARAM_BOUNDS[field]
+        if value is None:
+            problems.append({"fields": [field], "message": f"{field} is missing or not a number"})
+        elif field == 'yrs' and value != int(value):
+            problems.append({"fields": [field], "message": f"yrs={value:g} is not a whole number of years"})
+        elif (low is not None and value < low) or (high is not None and value > high):
+            problems.append({"fields": [field], "message": f"{field}={value:g} is outside [{low}, {high}]"})
+        if field == 'yrs' and value is not None and value == int(value):
+            value = int(value)
+        values[field] = value
+    
+    spend, init_net = values['spend'], values['init_net']
+    if spend is not None and init_net is not None and init_net > 0 and spend > MAX_SPEND_RATIO * init_net:
+        problems.append({"fields": ['spend', 'init_net'],
+                         "message": f"annual spend {spend:,.0f} exceeds {MAX_SPEND_RATIO:g}x net worth {init_net:,.0f}"})
+    mu, sigma = values['return_mu'], values['return_sigma']
+    if mu is not None and sigma is not None and 0 < sigma < 1 and abs(mu) < 1:
+        problems.append({"fields": ['return_mu', 'return_sigma'],
+                         "message": "return_mu and return_sigma look like decimals (e.g. 0.07), not percentages"})
+    return values, problems
+
+
+def _number(value) -> Optional[float]:
+    """value as a finite float, accepting strings like "7%" or "1,000,000"; None otherwise."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(",", "").rstrip("%")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def default_tiers(cheap_model: str = "openai/gpt-4o-mini", strong_model: str = "openai/gpt-4o",
+                  api_base: Optional[str] = None, cache: Optional[LMCache] = None,
+                  logger=None) -> List[Tuple[str, dspy.Module, Any]]:
+    """
+    The LM tiers of the default cascade, cheapest first, behind the on-disk LM cache.
+    
+    "predict" is the Predict(QueryParser) compiled by pipeline/distill.py
+    (plain Predict if none is saved) on cheap_model with a short completion
+    budget; "chain_of_thought" is ChainOfThought(QueryParser) on
+    strong_model. With api_base (e.g. pipeline/stub_lm.py) both models are
+    served from there.
+    """
+    cache = cache if cache is not None else LMCache()
+    lm_kwargs = {"api_base": api_base, "api_key": "stub", "cache": False} if api_base else {}
+    predict = ProgramRegistry().load("query_parser", dspy.Predict(QueryParser))
+    if predict is None:
+        predict = dspy.Predict(QueryParser)
+    return [
+        ("predict", CachedModule(predict, cache, logger=logger, name="QueryParser[predict]"),
+         dspy.LM(model=cheap_model, max_tokens=200, **lm_kwargs)),
+        ("chain_of_thought", CachedModule(dspy.ChainOfThought(QueryParser), cache, logger=logger,
+                                          name="QueryParser[chain_of_thought]"),
+         dspy.LM(model=strong_model, max_tokens=1000, **lm_kwargs))
+    ]
+
+
+class ParserCascade:
+    """Parse queries with the cheapest tier that yields plausible parameters.
+    
+    LM tiers are (name, module, lm) tuples, cheapest first: module is called
+    as module(query=...) under ``dspy.context(lm=lm)`` (the configured LM
+    when lm is None), and only the fields implicated in the current
+    problems are taken from its answer; values an earlier tier got right
+    are kept. A tier that raises counts as a failed attempt and escalates,
+    except on transient errors (rate limits, timeouts), which are raised
+    for the caller to retry since a stronger tier would meet them too.
+    The default tiers (see default_tiers) are built on the first
+    escalation, so queries the fast path settles need no LM at all.
+    
+    Every parse is kept in ``outcomes`` and sent to ``logger.log_cascade``;
+    ``summary()`` gives per-tier hit rates. With a tracker
+    (utils.lm_usage) each tier's LM calls are attributed to step
+    "parsing:<tier>". With a bucket (pipeline.batch.TokenBucket) a token
+    is taken before every LM tier call, so a query that escalates takes
+    one per tier it reaches.
+    
+    Usage:
+        cascade = ParserCascade(logger=get_logger())
+        result = cascade.parse("25年後退休，年報酬7%，波動15%，每年花100萬，目前有300萬")
+    """
+    
+    def __init__(self, tiers: Optional[List[Tuple[str, dspy.Module, Any]]] = None, fast_path: bool = True,
+                 threshold: float = 0.8, logger=None, tracker=None, bucket=None):
+        self.tiers = tiers
+        self.fast_path = fast_path
+        self.threshold = threshold
+        self.logger = logger
+        self.tracker = tracker
+        self.bucket = bucket
+        self.outcomes: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+    
+    def prepare(self, query: str) -> Dict[str, Any]:
+        """
+        Run the fast path on query; no "problems" means no LM call is needed.
+        
+        Returns:
+        --------
+        dict
+            "params" and "problems" (see check_params), "confidence" of each
+            field's fast-path value (None without the fast path) and
+            "latency_ms"; pass it to parse() to continue the cascade
+        """
+        started = time.perf_counter()
+        parsed = parse_query(query) if self.fast_path else None
+        params, problems = check_params(resolve(parsed, self.threshold)[0] if parsed is not None else {})
+        return {
+            "params": params,
+            "problems": problems,
+            "confidence": {field: parsed[field]["confidence"] for field in FIELDS} if parsed is not None else None,
+            "latency_ms": (time.perf_counter() - started) * 1000
+        }
+    
+    def parse(self, query: str, prepared: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Parse query through the cascade.
+        
+        Parameters:
+        -----------
+        query : str
+            Natural-language query
+        prepared : dict, optional
+            prepare(query) if already run, so the fast path is not repeated
+        
+        Returns:
+        --------
+        dict
+            - "params": every QueryParser field (PARAM_DEFAULTS where still missing)
+            - "tier": the tier whose parse was accepted, None if none was
+            - "problems": what is still implausible (empty when accepted)
+            - "attempts": one per tier tried, with "tier", "fields" (asked
+              for), "problems", "error", "response" and "latency_ms"; the
+              fast path's also has each field's "confidence"
+            - "latency_ms": total
+        """
+        prepared = prepared if prepared is not None else self.prepare(query)
+        started = time.perf_counter()
+        params, problems = prepared["params"], prepared["problems"]
+        attempts = []
+        if self.fast_path:
+            attempts.append({"tier": "fast_path", "fields": list(FIELDS), "problems": problems, "error": None,
+                             "response": None, "confidence": prepared["confidence"],
+                             "latency_ms": prepared["latency_ms"]})
+        
+        for name, module, lm in (self._lm_tiers() if problems else []):
+            pending = [field for field in FIELDS if any(field in problem["fields"] for problem in problems)]
+            attempt = {"tier": name, "fields": pending, "problems": problems, "error": None, "response": None}
+            tier_started = time.perf_counter()
+            try:
+                prediction = self._call(name, module, lm, query)
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                attempt["error"] = f"{type(e).__name__}: {e}"
+            else:
+                params, problems = check_params({**params, **{field: getattr(prediction, field, None) for field in pending}})
+                attempt.update(problems=problems, response=str(prediction))
+            attempt["latency_ms"] = (time.perf_counter() - tier_started) * 1000
+            attempts.append(attempt)
+            if attempt["error"] is None and not problems:
+                break
+        
+        last = attempts[-1] if attempts else None
+        accepted = last is not None and last["error"] is None and not last["problems"]
+        result = {
+            "params": {field: params[field] if params[field] is not None else PARAM_DEFAULTS[field] for field in FIELDS},
+            "tier": last["tier"] if accepted else None,
+            "problems": problems,
+            "attempts": attempts,
+            "latency_ms": prepared["latency_ms"] + (time.perf_counter() - started) * 1000
+        }
+        with self._lock:
+            self.outcomes.append({"tier": result["tier"], "attempts": [attempt["tier"] for attempt in attempts]})
+        if self.logger is not None:
+            self.logger.log_cascade(result)
+        return result
+    
+    def __call__(self, query: str) -> dspy.Prediction:
+        """parse() as a drop-in QueryParser (e.g. for pipeline.batch): the parameters as a Prediction."""
+        return dspy.Prediction(**self.parse(query)["params"])
+    
+    def summary(self) -> Dict[str, Any]:
+        """Per-tier attempts, acceptances and hit rates (see utils.logger.summarize_cascade)."""
+        with self._lock:
+            return summarize_cascade(list(self.outcomes))
+    
+    def _lm_tiers(self) -> List[Tuple[str, dspy.Module, Any]]:
+        with self._lock:
+            if self.tiers is None:
+                self.tiers = default_tiers(logger=self.logger)
+            return self.tiers
+    
+    def _call(self, name: str, module: dspy.Module, lm: Any, query: str):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        with contextlib.ExitStack() as stack:
+            if lm is not None:
+                stack.enter_context(dspy.context(lm=lm))
+            if self.tracker is not None:
+                stack.enter_context(self.tracker.step(f"parsing:{name}"))
+            return module(query=query)
+
+
+def main():
+    from pipeline.distill import field_accuracy, load_corpus
+    
+    parser = argparse.ArgumentParser(description="Run the QueryParser cascade over a labeled corpus")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="Labeled queries (JSONL)")
+    parser.add_argument("--model", default="openai/gpt-4o-mini", help="Model of the cheap Predict tier")
+    parser.add_argument("--strong-model", default="openai/gpt-4o", help="Model of the ChainOfThought tier")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint, e.g. pipeline/stub_lm.py")
+    parser.add_argument("--no-fast-path", action="store_true", help="Start at the first LM tier")
+    args = parser.parse_args()
+    
+    if not args.api_base and not load_api_key():
+        sys.exit(1)
+    
+    logger = get_logger()
+    logger.start_query(f"parser cascade over {args.corpus}", source="cascade")
+    tracker = track_lm_usage(logger)
+    cascade = ParserCascade(default_tiers(args.model, args.strong_model, args.api_base, logger=logger),
+                            fast_path=not args.no_fast_path, logger=logger, tracker=tracker)
+    
+    examples = load_corpus(args.corpus)
+    scores = []
+    for example in examples:
+        result = cascade.parse(example.query)
+        scores.append(field_accuracy(example, dspy.Prediction(**result["params"])))
+    
+    summary = cascade.summary()
+    usage = tracker.summary()
+    print(f"\n{'tier':<18} {'attempts':>8} {'accepted':>8} {'hit rate':>8} {'share':>7} {'tokens':>8}")
+    for name, stats in summary["tiers"].items():
+        tokens = usage["by_step"].get(f"parsing:{name}", {}).get("total_tokens", 0)
+        print(f"{name:<18} {stats['attempts']:>8} {stats['accepted']:>8} {stats['hit_rate']:>8.0%} "
+              f"{stats['share']:>7.0%} {tokens:>8}")
+    print(f"\n{summary['parses']} queries, {summary['rejected']} rejected by every tier, "
+          f"field accuracy {sum(scores) / len(scores):.1%}, exact match {sum(s == 1.0 for s in scores) / len(scores):.1%}")
+    
+    logger.log_comparison_results({"cascade": summary, "field_accuracy": sum(scores) / len(scores)})
+    logger.save_entry()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Distill the ChainOfThought QueryParser into a few-shot dspy.Predict program
+
+The ChainOfThought parser writes a reasoning trace before the fields, which
+pure extraction does not need. This pipeline lets the CoT program parse the
+training queries, keeps the parses that match the labels, compiles a
+Predict(QueryParser) on them with BootstrapFewShot, compares both programs
+on a held-out split (accuracy, latency, tokens) and saves the compiled
+program to the program registry (programs/query_parser/), where
+pipeline/run.py loads it.
+
+Usage:
+    python pipeline/distill.py [--corpus data/query_corpus.jsonl] [--unlabeled queries.txt]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import dspy
+from dspy.teleprompt import BootstrapFewShot
+
+# Add parent directory to path to import from utils and pipeline
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.run import QueryParser, load_api_key
+from utils.fast_parser import DEFAULT_CORPUS, FIELDS
+from utils.logger import get_logger
+from utils.lm_usage import track_lm_usage
+from utils.program_registry import PROGRAMS_DIR, ProgramRegistry
+
+
+def field_accuracy(example: dspy.Example, prediction: Any, trace=None):
+    """Share of fields matching the labels (relative tolerance 1e-3); all-or-nothing while bootstrapping."""
+    correct = [_matches(getattr(prediction, field, None), example[field]) for field in FIELDS]
+    if trace is not None:
+        return all(correct)
+    return sum(correct) / len(FIELDS)
+
+
+def _matches(value, expected) -> bool:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return False
+    return abs(value - expected) <= 1e-3 * max(1.0, abs(expected))
+
+
+def load_corpus(path=DEFAULT_CORPUS) -> List[dspy.Example]:
+    """Labeled queries ({"query", "expected"} JSONL) as dspy Examples with input "query"."""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append(dspy.Example(query=row["query"], **row["expected"]).with_inputs("query"))
+    return examples
+
+
+def bootstrap_labels(teacher: dspy.Module, examples: List[dspy.Example],
+                     unlabeled: Optional[List[str]] = None) -> List[dspy.Example]:
+    """
+    Parse queries with the teacher and keep its outputs as training labels.
+    
+    Labeled examples are kept only when the teacher gets every field right;
+    unlabeled queries keep whatever the teacher produced with all fields
+    present. Reasoning is dropped, since the student does not produce it.
+    """
+    distilled = []
+    for example in examples:
+        prediction = teacher(query=example.query)
+        if field_accuracy(example, prediction, trace=True):
+            distilled.append(dspy.Example(query=example.query, **{f: example[f] for f in FIELDS}).with_inputs("query"))
+    for query in unlabeled or []:
+        prediction = teacher(query=query)
+        values = {field: getattr(prediction, field, None) for field in FIELDS}
+        if all(value is not None for value in values.values()):
+            distilled.append(dspy.Example(query=query, **values).with_inputs("query"))
+    return distilled
+
+
+def distill(trainset: List[dspy.Example], teacher: Optional[dspy.Module] = None,
+            unlabeled: Optional[List[str]] = None, max_labeled_demos: int = 8,
+            max_bootstrapped_demos: int = 4) -> dspy.Predict:
+    """
+    Compile a few-shot Predict(QueryParser) from the teacher's parses of trainset.
+    
+    Parameters:
+    -----------
+    trainset : list of dspy.Example
+        Labeled training queries
+    teacher : dspy.Module, optional
+        Program producing the labels; ChainOfThought(QueryParser) by default
+    unlabeled : list of str, optional
+        Extra queries labeled by the teacher alone
+    max_labeled_demos, max_bootstrapped_demos : int
+        BootstrapFewShot demo budgets
+    
+    Returns:
+    --------
+    dspy.Predict
+        The compiled student program
+    """
+    teacher = teacher or dspy.ChainOfThought(QueryParser)
+    labeled = bootstrap_labels(teacher, trainset, unlabeled)
+    if not labeled:
+        raise ValueError("The teacher parsed no training query correctly")
+    optimizer = BootstrapFewShot(metric=field_accuracy, max_bootstrapped_demos=max_bootstrapped_demos,
+                                 max_labeled_demos=max_labeled_demos)
+    return optimizer.compile(dspy.Predict(QueryParser), trainset=labeled)
+
+
+def evaluate(program: dspy.Module, examples: List[dspy.Example], tracker, step: str) -> Dict[str, Any]:
+    """
+    Accuracy, latency and LM tokens of program on examples, one query at a time.
+    
+    Returns:
+    --------
+    dict
+        "field_accuracy" (mean share of correct fields), "exact_match" (share
+        of queries with every field right), "latency_ms" ({"mean", "p50",
+        "p95"} per query), "tokens_per_query" and "errors"
+    """
+    scores, latencies, errors = [], [], 0
+    with tracker.step(step):
+        for example in examples:
+            started = time.perf_counter()
+            try:
+                prediction = program(query=example.query)
+                scores.append(field_accuracy(example, prediction))
+            except Exception:
+                errors += 1
+                scores.append(0.0)
+            latencies.append((time.perf_counter() - started) * 1000)
+    usage = tracker.summary()["by_step"].get(step, {})
+    latencies.sort()
+    return {
+        "field_accuracy": sum(scores) / len(scores),
+        "exact_match": sum(score == 1.0 for score in scores) / len(scores),
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        },
+        "tokens_per_query": usage.get("total_tokens", 0) / len(examples),
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill ChainOfThought(QueryParser) into a few-shot Predict")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="Labeled queries (JSONL)")
+    parser.add_argument("--unlabeled", help="Extra queries, one per line, labeled by the teacher")
+    parser.add_argument("--holdout", type=float, default=0.4, help="Share of the corpus held out for evaluation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-labeled-demos", type=int, default=8)
+    parser.add_argument("--max-bootstrapped-demos", type=int, default=4)
+    parser.add_argument("--registry", default=str(PROGRAMS_DIR), help="Program registry directory")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint, e.g. pipeline/stub_lm.py")
+    args = parser.parse_args()
+    
+    logger = get_logger()
+    logger.start_query("distill ChainOfThought(QueryParser) -> Predict", source="distill")
+    
+    # No LM cache: latencies and tokens must reflect real calls
+    if args.api_base:
+        lm = dspy.LM(model=args.model, api_base=args.api_base, api_key="stub", max_tokens=500, cache=False)
+    else:
+        if not load_api_key():
+            sys.exit(1)
+        lm = dspy.LM(model=args.model, max_tokens=500, cache=False)
+    dspy.configure(lm=lm)
+    tracker = track_lm_usage(logger)
+    
+    examples = load_corpus(args.corpus)
+    random.Random(args.seed).shuffle(examples)
+    split = max(1, int(len(examples) * (1 - args.holdout)))
+    trainset, heldout = examples[:split], examples[split:]
+    unlabeled = None
+    if args.unlabeled:
+        with open(args.unlabeled, encoding="utf-8") as f:
+            unlabeled = [line.strip() for line in f if line.strip()]
+    
+    teacher = dspy.ChainOfThought(QueryParser)
+    print(f"Distilling on {len(trainset)} labeled queries, evaluating on {len(heldout)} held out...")
+    with tracker.step("distill"):
+        student = distill(trainset, teacher, unlabeled, args.max_labeled_demos, args.max_bootstrapped_demos)
+    
+    report = {
+        "trainset": len(trainset),
+        "heldout": len(heldout),
+        "demos": len(student.demos),
+        "chain_of_thought": evaluate(teacher, heldout, tracker, "eval_chain_of_thought"),
+        "compiled_predict": evaluate(student, heldout, tracker, "eval_compiled_predict")
+    }
+    
+    saved = ProgramRegistry(args.registry).save("query_parser", student, metadata={
+        "optimizer": "BootstrapFewShot",
+        "teacher": "ChainOfThought(QueryParser)",
+        "trainset": report["trainset"],
+        "compiled_predict": report["compiled_predict"]
+    })
+    report["saved_to"] = str(saved)
+    
+    print(f"\n{'program':<18} {'field acc':>9} {'exact':>7} {'p50 ms':>8} {'mean ms':>8} {'tokens/q':>9}")
+    for name in ("chain_of_thought", "compiled_predict"):
+        stats = report[name]
+        print(f"{name:<18} {stats['field_accuracy']:>9.1%} {stats['exact_match']:>7.1%} "
+              f"{stats['latency_ms']['p50']:>8.0f} {stats['latency_ms']['mean']:>8.0f} {stats['tokens_per_query']:>9.0f}")
+    print(f"\nCompiled Predict ({report['demos']} demos) saved to {saved}")
+    
+    logger.log_comparison_results(report)
+    logger.save_entry()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,12 @@ import json
 import sys
 import os
 
-# Add parent directory to path to import from prompts
+# Add parent directory to path to import from simulation and utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from prompts.retire import RetireSim
+from simulation.service import SimulationService
+from utils.lm_usage import track_lm_usage
 from utils.logger import get_logger
+from utils.program_registry import ProgramRegistry
 
 
 class QueryParser(dspy.Signature):
@@ -22,6 +24,36 @@ class QueryParser(dspy.Signature):
     goal_pct: float = dspy.OutputField(desc="Maximum acceptable bankruptcy probability as percentage")
 
 
+def load_parser() -> dspy.Module:
+    """The compiled Predict(QueryParser) from the program registry if a current one exists, else ChainOfThought(QueryParser)."""
+    parser = ProgramRegistry().load("query_parser", dspy.Predict(QueryParser))
+    return parser if parser is not None else dspy.ChainOfThought(QueryParser)
+
+
+def load_api_key() -> bool:
+    """Export OPENAI_API_KEY from config.py; False, with setup instructions printed, if config.py is missing."""
+    try:
+        from config import OPENAI_API_KEY
+    except ImportError:
+        print("Error: config.py not found")
+        print("Please copy config.example.py to config.py and add your API key")
+        return False
+    os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
+    return True
+
+
+# Parameter values used when the LM omits a field
+PARAM_DEFAULTS = {
+    'yrs': 25,
+    'return_mu': 7.0,
+    'return_sigma': 15.0,
+    'spend': 1000000.0,
+    'init_net': 3000000.0,
+    'inflation': 3.0,
+    'goal_pct': 5.0
+}
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python run.py \"<natural language query>\"")
@@ -36,95 +68,67 @@ def main():
     logger.start_query(nl_query, source="cli")
     
     try:
-        # Initialize dspy with a language model
-        # Configure with OpenAI GPT model
-        import os
-        
-        # Setup API key from config
-        try:
-            from config import OPENAI_API_KEY
-            os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
-        except ImportError:
-            error_msg = "config.py not found"
-            logger.log_error(error_msg, "initialization")
-            logger.save_entry()
-            print("Error: config.py not found")
-            print("Please copy config.example.py to config.py and add your API key")
-            sys.exit(1)
-        
-        # Configure dspy with OpenAI
-        # Use LM class with provider
-        lm = dspy.LM(model='openai/gpt-4o-mini', max_tokens=500)
-        dspy.configure(lm=lm)
-        
-        # Create parser agent
-        parser = dspy.ChainOfThought(QueryParser)
-        
-        # Parse the natural language query
+        # Parser cascade: rule-based fast path, then a cheap Predict, then
+        # ChainOfThought on a stronger model, each only if the parse so far
+        # fails validation
+        from pipeline.cascade import ParserCascade
         print(f"Parsing query: {nl_query}")
-        parsed = parser(query=nl_query)
-        
-        # Extract parameters with defaults for missing values
-        params = {
-            'yrs': parsed.yrs if hasattr(parsed, 'yrs') else 25,
-            'return_mu': parsed.return_mu if hasattr(parsed, 'return_mu') else 7.0,
-            'return_sigma': parsed.return_sigma if hasattr(parsed, 'return_sigma') else 15.0,
-            'spend': parsed.spend if hasattr(parsed, 'spend') else 1000000.0,
-            'init_net': parsed.init_net if hasattr(parsed, 'init_net') else 3000000.0,
-            'inflation': parsed.inflation if hasattr(parsed, 'inflation') else 3.0,
-            'goal_pct': parsed.goal_pct if hasattr(parsed, 'goal_pct') else 5.0
-        }
+        cascade = ParserCascade(logger=logger)
+        prepared = cascade.prepare(nl_query)
+        problems = prepared["problems"]
+        
+        if problems:
+            # Setup API key from config
+            if not load_api_key():
+                logger.log_error("config.py not found", "initialization")
+                logger.save_entry()
+                sys.exit(1)
+            
+            # Log model, tokens and latency of every LM call, per cascade tier
+            cascade.tracker = track_lm_usage(logger)
+            print(f"Fast path left for the LM: {'; '.join(problem['message'] for problem in problems)}")
+        
+        parsed = cascade.parse(nl_query, prepared)
+        params = parsed["params"]
+        unresolved = parsed["attempts"][1]["fields"] if len(parsed["attempts"]) > 1 else []
+        raw_response = parsed["attempts"][-1]["response"]
+        print(f"Parsed by: {' -> '.join(attempt['tier'] for attempt in parsed['attempts'])}")
+        if parsed["tier"] is None:
+            print(f"Warning: no parser tier produced plausible parameters: "
+                  f"{'; '.join(problem['message'] for problem in parsed['problems'])}")
         
         # Log parsing results
-        logger.log_parsing(params, str(parsed))
+        logger.log_parsing(params, raw_response, fast_path={
+            "unresolved": unresolved,
+            "confidence": prepared["confidence"]
+        })
         
         print(f"\nParsed parameters:")
         for key, value in params.items():
             print(f"  {key}: {value}")
         
-        # Initialize and run the retirement simulation
-        sim = RetireSim()
+        # Run the simulation through the service behind RetireSim, with
+        # per-phase timing for the log
+        service = SimulationService(profile=True)
         
-        # Convert percentages to decimals for the simulation
-        sim_params = params.copy()
-        sim_params['return_mu'] = params['return_mu'] / 100.0
-        sim_params['return_sigma'] = params['return_sigma'] / 100.0
-        sim_params['inflation'] = params['inflation'] / 100.0
+        # Log Monte Carlo start (decimal rates, as simulated)
+        logger.log_monte_carlo_start(service.normalize(params))
         
-        # Log Monte Carlo start
-        logger.log_monte_carlo_start(sim_params)
-        
-        # Run simulation
+        # Run simulation; the analytic pre-screen answers clear-cut plans
+        # without Monte Carlo
         print("\nRunning Monte Carlo simulation...")
-        from simulation.monte_carlo import run_sim
-        
-        results = run_sim(
-            mu=sim_params['return_mu'],
-            sigma=sim_params['return_sigma'],
-            yrs=params['yrs'],
-            init_net=params['init_net'],
-            spend=params['spend'],
-            inflation=sim_params['inflation'],
-            n=10000
-        )
+        metrics, results = service.evaluate({**params, 'prescreen': True}, return_results=True)
+        if metrics.get('method') == 'analytic':
+            print("Decided analytically by the pre-screen; Monte Carlo skipped")
         
-        # Log Monte Carlo results
-        logger.log_monte_carlo_results(results)
+        # Log Monte Carlo results (None when answered without simulating)
+        if results is not None:
+            from simulation.metrics import percentile_bands
+            bands = percentile_bands(results['paths'], (0, 10, 50, 90, 100))
+            logger.log_monte_carlo_results(results, bands, results['tail_risk'])
         
         # Prepare output metrics
-        import numpy as np
-        positive_balances = results['final_balance'][results['final_balance'] > 0]
-        
-        metrics = {
-            'bankruptcy_probability': float(results['bankruptcy_prob']),
-            'meets_goal': bool(results['bankruptcy_prob'] <= params['goal_pct']),
-            'final_balance_mean': float(np.mean(results['final_balance'])),
-            'final_balance_median': float(np.median(results['final_balance'])),
-            'final_balance_positive_mean': float(np.mean(positive_balances)) if len(positive_balances) > 0 else 0.0,
-            'final_balance_10th_percentile': float(np.percentile(results['final_balance'], 10)),
-            'final_balance_90th_percentile': float(np.percentile(results['final_balance'], 90)),
-            'parameters': params
-        }
+        metrics = {**metrics, 'meets_goal': bool(metrics['meets_goal']), 'parameters': params}
         
         # Log final output
         logger.log_final_output(metrics)
@@ -138,7 +142,7 @@ def main():
         
         print(f"\n📊 Session logged to: {logger.session_file}")
         print(f"📝 Summary available at: {logger.summary_file}")
-        
+    
     except Exception as e:
         # Log error
         logger.log_error(str(e), "execution")
@@ -0,0 +1,159 @@
+"""
+Local OpenAI-compatible stub LM server for exercising the parsing pipeline without API calls
+
+Answers /v1/chat/completions in dspy's chat-adapter format, filling each
+requested output field from the rule-based parser (utils.fast_parser) or
+the pipeline defaults, after a configurable latency and with a configurable
+share of HTTP 429 responses. GET /stats reports request counts and the peak
+number of requests in flight.
+
+Usage:
+    python pipeline/stub_lm.py --port 8765 --latency 0.5 --error-rate 0.1
+    python pipeline/batch.py queries.txt --api-base http://127.0.0.1:8765/v1
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+# Add parent directory to path to import from utils and pipeline
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.run import PARAM_DEFAULTS
+from utils.fast_parser import FIELDS, parse_query
+
+
+class StubLM:
+    """The stub server, run in a background thread; usable as a context manager."""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self.address: Tuple[str, int] = self._server.server_address[:2]
+        self.api_base = f"http://{self.address[0]}:{self.address[1]}/v1"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    
+    def start(self) -> "StubLM":
+        self._thread.start()
+        return self
+    
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.close()
+        return False
+    
+    def complete(self, request: dict) -> Optional[dict]:
+        """Chat-completion response for a request, or None to answer 429."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+            fail = self._random.random() < self.error_rate
+        try:
+            time.sleep(self.latency)
+            if fail:
+                with self._lock:
+                    self.stats["errors"] += 1
+                return None
+            content = _answer(request.get("messages", []))
+        finally:
+            with self._lock:
+                self.stats["in_flight"] -= 1
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in request.get("messages", []))
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"stub-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+
+def _answer(messages: list) -> str:
+    """Chat-adapter answer: every requested output field, from the rule-based parser."""
+    system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+    user = str(messages[-1].get("content", "")) if messages else ""
+    match = re.search(r"\[\[ ## query ## \]\]\s*(.*?)\s*(?:\[\[ ##|$)", user, re.S)
+    query = match.group(1) if match else user
+    outputs = re.search(r"Your output fields are:(.*?)(?:\n\n|All interactions)", system, re.S)
+    fields = re.findall(r"`(\w+)`", outputs.group(1)) if outputs else ["reasoning", *FIELDS]
+    
+    parsed = parse_query(query)
+    sections = []
+    for field in fields:
+        if field in PARAM_DEFAULTS:
+            value = parsed[field]["value"] if parsed[field]["value"] is not None else PARAM_DEFAULTS[field]
+        else:
+            value = "Stub answer from the rule-based parser."
+        sections.append(f"[[ ## {field} ## ]]\n{value}")
+    sections.append("[[ ## completed ## ]]")
+    return "\n\n".join(sections)
+
+
+def _handler(stub: StubLM):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            response = stub.complete(json.loads(body or b"{}"))
+            if response is None:
+                self._reply(429, {"error": {"message": "Rate limit exceeded (stub)", "type": "rate_limit_error"}})
+            else:
+                self._reply(200, response)
+        
+        def do_GET(self):
+            with stub._lock:
+                self._reply(200, dict(stub.stats))
+        
+        def _reply(self, status: int, payload: dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def log_message(self, *args):
+            pass
+    
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LM for the parsing pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 429")
+    args = parser.parse_args()
+    stub = StubLM(args.host, args.port, args.latency, args.error_rate)
+    print(f"Stub LM listening on {stub.api_base}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
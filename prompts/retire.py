@@ -3,8 +3,8 @@ import datetime as dt
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from simulation import monte_carlo
-import numpy as np
+from typing import List, Optional
+from simulation.service import SimulationService
 
 
 class Retire(dspy.Signature):
@@ -20,14 +20,28 @@ class Retire(dspy.Signature):
 
 
 class RetireSim(dspy.Module):
-    """Monte Carlo simulation module for retirement planning."""
+    """Monte Carlo simulation module for retirement planning.
     
-    def __init__(self):
+    A thin DSPy wrapper over simulation.service.SimulationService, which the
+    CLI pipeline uses too, so both share one metrics definition and cache.
+    
+    Parameters:
+    - n: paths per simulation
+    - engine: "daily" (run_sim's 365-step engine), "annual" (simulation.batch,
+      the same model with one draw per year, vectorized across parameter sets)
+      or "auto" (daily for forward, annual for forward_batch)
+    - seed: makes every call reproducible when set
+    - service: an existing SimulationService to share (n, engine and seed are then ignored)
+    """
+    
+    def __init__(self, n: int = 10000, engine: str = "auto", seed: Optional[int] = None,
+                 service: Optional[SimulationService] = None):
         super().__init__()
+        self.service = service if service is not None else SimulationService(n=n, engine=engine, seed=seed)
     
     def forward(self, **kwargs):
         """
-        Run retirement simulation using monte_carlo.run_sim and return metrics.
+        Run retirement simulation through the simulation service and return metrics.
         
         Parameters from kwargs:
         - yrs: years until retirement
@@ -37,51 +51,72 @@ class RetireSim(dspy.Module):
         - init_net: current net worth (TWD)
         - inflation: annual inflation (%)
         - goal_pct: max bankruptcy probability (%)
+        - prescreen: if True, answer analytically (no Monte Carlo) when the
+          approximation is clearly on one side of goal_pct
+        - start_age: optional age at year 0, for the median ruin age
+        - cashflows: optional per-year withdrawal schedule (see
+          simulation.cashflow.compile_schedule) replacing spend and inflation
         
         Returns:
-        - dict: Dictionary containing simulation metrics
+        - dict: Dictionary containing simulation metrics; repeated questions
+          are answered from the service's cache
         """
-        # Extract parameters
-        yrs = kwargs.get('yrs', 25)
-        return_mu = kwargs.get('return_mu', 7.0) / 100.0  # Convert percentage to decimal
-        return_sigma = kwargs.get('return_sigma', 15.0) / 100.0  # Convert percentage to decimal
-        spend = kwargs.get('spend', 1000000.0)
-        init_net = kwargs.get('init_net', 3000000.0)
-        inflation = kwargs.get('inflation', 3.0) / 100.0  # Convert percentage to decimal
-        goal_pct = kwargs.get('goal_pct', 5.0)
-        
-        # Run Monte Carlo simulation with updated signature
-        results = monte_carlo.run_sim(
-            mu=return_mu,
-            sigma=return_sigma,
-            yrs=yrs,
-            init_net=init_net,
-            spend=spend,
-            inflation=inflation,
-            n=10000
-        )
-        
-        # Extract results
-        paths = results['paths']
-        final_balances = results['final_balance']
-        bankruptcy_prob = results['bankruptcy_prob']
-        
-        # Calculate additional metrics
-        positive_balances = final_balances[final_balances > 0]
+        return self.service.evaluate(kwargs)
+    
+    def forward_batch(self, batch) -> List[dict]:
+        """
+        Evaluate many parameter sets; returns one metrics dict per set, in order.
         
-        # Create metrics dictionary
-        metrics = {
-            'bankruptcy_probability': bankruptcy_prob,
-            'meets_goal': bankruptcy_prob <= goal_pct,
-            'median_end_balance': float(np.median(final_balances)),
-            'mean_end_balance': float(np.mean(final_balances)),
-            'percentile_10': float(np.percentile(final_balances, 10)),
-            'percentile_90': float(np.percentile(final_balances, 90)),
-            'mean_positive_balance': float(np.mean(positive_balances)) if len(positive_balances) > 0 else 0.0,
-            'n_simulations': 10000
-        }
+        batch: a list of forward kwargs dicts, or a DataFrame with one row per
+        set (missing/NaN columns take forward's defaults). With the annual
+        engine, sets with the same yrs are simulated together as one
+        vectorized batch sharing their draws; with the daily engine each set
+        runs through forward.
+        """
+        return self.service.evaluate_batch(batch)
+
+
+class RetireTool:
+    """RetireSim as a DSPy tool for agent-style planning, one instance per conversation.
+    
+    Calls are answered by a SimulationService with the "warm" engine: results
+    are cached for the conversation, and every simulation reuses the same
+    draws, so a what-if ("retire 3 years later?", "spend 10% less?") only
+    re-runs the yearly recursion instead of a full simulation. Comparisons
+    between what-ifs are then also free of sampling noise.
+    
+    Usage:
+        tool = RetireTool()
+        agent = dspy.ReAct("question -> answer", tools=[tool.as_tool()])
+    """
+    
+    name = "simulate_retirement"
+    
+    def __init__(self, n: int = 10000, seed: Optional[int] = None, cache_size: int = 64):
+        self.sim = RetireSim(service=SimulationService(n=n, engine="warm", seed=seed, cache_size=cache_size))
+    
+    def __call__(self, yrs: int, return_mu: float, return_sigma: float, spend: float, init_net: float,
+                 inflation: float, goal_pct: float = 5.0) -> dict:
+        """Simulate a retirement plan and return its bankruptcy probability and end-balance metrics.
         
-        return metrics
+        yrs: years the savings must last; return_mu: expected mean annual return (%);
+        return_sigma: annual std-dev (%); spend: annual spend (TWD); init_net:
+        current net worth (TWD); inflation: annual inflation (%); goal_pct: max
+        acceptable bankruptcy probability (%).
+        """
+        return self.sim(yrs=yrs, return_mu=return_mu, return_sigma=return_sigma, spend=spend,
+                        init_net=init_net, inflation=inflation, goal_pct=goal_pct)
+    
+    def as_tool(self) -> "dspy.Tool":
+        """This tool wrapped for dspy.ReAct and other tool-using modules."""
+        return dspy.Tool(self.__call__, name=self.name, desc=self.__call__.__doc__)
+    
+    def new_conversation(self):
+        """Start a new conversation: drop cached results and draws."""
+        self.sim.service.clear_cache()
+    
+    def cache_info(self) -> dict:
+        return self.sim.service.cache_info()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""
+Mergeable partial aggregates of Monte Carlo results, for chunked and sharded runs
+"""
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+class RuinAggregate:
+    """Sufficient statistics of a ruin-probability estimate that merge exactly.
+    
+    Plain and importance-sampled chunks keep sums of the weighted ruin
+    indicator and its square. Stratified chunks (run_sim with ``strata``)
+    keep per-stratum trial and ruin counts instead, so merged chunks give the
+    same stratum-weighted estimate as one large run. Weighted sums of the
+    final balance are kept in both cases for the mean terminal balance.
+    """
+    
+    def __init__(self, n: int = 0, ruin_sum: float = 0.0, ruin_sq_sum: float = 0.0,
+                 balance_sum: float = 0.0, balance_sq_sum: float = 0.0,
+                 strata_probabilities: Optional[np.ndarray] = None,
+                 strata_counts: Optional[np.ndarray] = None,
+                 strata_ruins: Optional[np.ndarray] = None):
+        self.n = n
+        self.ruin_sum = ruin_sum
+        self.ruin_sq_sum = ruin_sq_sum
+        self.balance_sum = balance_sum
+        self.balance_sq_sum = balance_sq_sum
+        self.strata_probabilities = strata_probabilities
+        self.strata_counts = strata_counts
+        self.strata_ruins = strata_ruins
+    
+    @classmethod
+    def from_result(cls, result: Dict[str, Any]) -> "RuinAggregate":
+        """Aggregate a run_sim result dict."""
+        final_balance = result["final_balance"]
+        weights = result["weights"]
+        ruin = weights * (final_balance <= 0)
+        aggregate = cls(
+            n=len(final_balance),
+            ruin_sum=float(ruin.sum()),
+            ruin_sq_sum=float(np.dot(ruin, ruin)),
+            balance_sum=float(np.dot(weights, final_balance)),
+            balance_sq_sum=float(np.dot(weights, final_balance**2))
+        )
+        if "strata" in result:
+            strata = result["strata"]
+            aggregate.strata_probabilities = np.asarray(strata["probabilities"], dtype=float)
+            aggregate.strata_counts = np.asarray(strata["counts"], dtype=int)
+            aggregate.strata_ruins = np.rint(strata["bankruptcy_prob"] / 100 * strata["counts"]).astype(int)
+        return aggregate
+    
+    def merge(self, other: "RuinAggregate") -> "RuinAggregate":
+        """Return the aggregate of both chunks (neither input is modified)."""
+        if (self.strata_counts is None) != (other.strata_counts is None):
+            raise ValueError("Cannot merge stratified and unstratified aggregates")
+        merged = RuinAggregate(
+            n=self.n + other.n,
+            ruin_sum=self.ruin_sum + other.ruin_sum,
+            ruin_sq_sum=self.ruin_sq_sum + other.ruin_sq_sum,
+            balance_sum=self.balance_sum + other.balance_sum,
+            balance_sq_sum=self.balance_sq_sum + other.balance_sq_sum
+        )
+        if self.strata_counts is not None:
+            if not np.allclose(self.strata_probabilities, other.strata_probabilities):
+                raise ValueError("Cannot merge aggregates with different strata")
+            merged.strata_probabilities = self.strata_probabilities
+            merged.strata_counts = self.strata_counts + other.strata_counts
+            merged.strata_ruins = self.strata_ruins + other.strata_ruins
+        return merged
+    
+    def summary(self) -> Dict[str, float]:
+        """Ruin probability, standard error and relative error (percentages), and mean final balance."""
+        if self.n == 0:
+            return {"bankruptcy_prob": float("nan"), "bankruptcy_prob_se": float("inf"),
+                    "relative_error": float("inf"), "final_balance_mean": float("nan")}
+        
+        if self.strata_counts is not None:
+            counts = np.maximum(self.strata_counts, 1)
+            stratum_prob = self.strata_ruins / counts
+            stratum_var = stratum_prob * (1 - stratum_prob) / np.maximum(counts - 1, 1)
+            bankruptcy_prob = float(np.dot(self.strata_probabilities, stratum_prob)) * 100
+            bankruptcy_prob_se = float(np.sqrt(np.dot(self.strata_probabilities**2, stratum_var))) * 100
+        else:
+            mean = self.ruin_sum / self.n
+            var = max(self.ruin_sq_sum - self.n * mean**2, 0.0) / (self.n - 1) if self.n > 1 else float("inf")
+            bankruptcy_prob = mean * 100
+            bankruptcy_prob_se = float(np.sqrt(var / self.n)) * 100
+        
+        return {
+            "bankruptcy_prob": bankruptcy_prob,
+            "bankruptcy_prob_se": bankruptcy_prob_se,
+            "relative_error": bankruptcy_prob_se / bankruptcy_prob if bankruptcy_prob > 0 else float("inf"),
+            "final_balance_mean": self.balance_sum / self.n
+        }
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form (see from_dict)."""
+        data = {
+            "n": self.n,
+            "ruin_sum": self.ruin_sum,
+            "ruin_sq_sum": self.ruin_sq_sum,
+            "balance_sum": self.balance_sum,
+            "balance_sq_sum": self.balance_sq_sum
+        }
+        if self.strata_counts is not None:
+            data["strata_probabilities"] = self.strata_probabilities.tolist()
+            data["strata_counts"] = self.strata_counts.tolist()
+            data["strata_ruins"] = self.strata_ruins.tolist()
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RuinAggregate":
+        """Rebuild an aggregate from to_dict output."""
+        aggregate = cls(**{k: data[k] for k in ("n", "ruin_sum", "ruin_sq_sum", "balance_sum", "balance_sq_sum")})
+        if "strata_counts" in data:
+            aggregate.strata_probabilities = np.asarray(data["strata_probabilities"], dtype=float)
+            aggregate.strata_counts = np.asarray(data["strata_counts"], dtype=int)
+            aggregate.strata_ruins = np.asarray(data["strata_ruins"], dtype=int)
+        return aggregate
@@ -0,0 +1,109 @@
+"""
+Asyncio-friendly simulation entry point with progress reporting and cancellation
+"""
+import asyncio
+import functools
+import inspect
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from simulation.aggregate import RuinAggregate
+from simulation.monte_carlo import run_sim
+
+
+async def run_sim_async(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
+                        inflation: float, n: int = 10000, chunk_size: int = 2000,
+                        progress: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                        executor: Optional[Executor] = None, **sim_kwargs) -> dict:
+    """
+    Run run_sim in chunks on an executor without blocking the event loop.
+    
+    After each chunk the partial results are merged (see RuinAggregate) and
+    ``progress`` is called with a dict of "trials_done", "n", "bankruptcy_prob",
+    "bankruptcy_prob_se", "relative_error" and "final_balance_mean"; it may be
+    a plain function or a coroutine function.
+    
+    Cancellation is cooperative: cancelling the awaiting task raises
+    CancelledError at the next chunk boundary. The chunk already running in
+    the executor finishes in the background and its result is discarded, so
+    at most one chunk of work is wasted.
+    
+    Parameters:
+    -----------
+    mu, sigma, yrs, init_net, spend, inflation, n :
+        As for run_sim
+    chunk_size : int, default=2000
+        Target trials per chunk; n is split into equal chunks of about this size
+    progress : callable, optional
+        Called after every chunk with the running estimate
+    executor : concurrent.futures.Executor, optional
+        Where chunks run; defaults to the event loop's default executor
+    **sim_kwargs :
+        Passed through to run_sim (importance_shift, strata, allocation, profile, ...),
+        except ``workspace``: each chunk's result would be a view into the
+        same buffers, overwritten by the next chunk before the merge
+    
+    Returns:
+    --------
+    dict
+        run_sim-style result over all n trials ("paths", "final_balance",
+        "weights", "bankruptcy_prob", "bankruptcy_prob_se", "relative_error",
+        plus "strata" when stratified), with the ruin statistics taken from the
+        merged aggregate
+    """
+    if sim_kwargs.get("workspace") is not None:
+        raise ValueError("run_sim_async does not accept a workspace: chunk results would share its buffers")
+    sim_kwargs.pop("workspace", None)
+    loop = asyncio.get_running_loop()
+    sizes = [len(part) for part in np.array_split(np.arange(n), max(1, round(n / chunk_size)))]
+    
+    chunks: List[dict] = []
+    aggregate = None
+    for size in sizes:
+        call = functools.partial(run_sim, mu, sigma, yrs, init_net, spend, inflation, n=size, **sim_kwargs)
+        result = await loop.run_in_executor(executor, call)
+        
+        part = RuinAggregate.from_result(result)
+        aggregate = part if aggregate is None else aggregate.merge(part)
+        chunks.append(result)
+        
+        if progress is not None:
+            update = progress({"trials_done": aggregate.n, "n": n, **aggregate.summary()})
+            if inspect.isawaitable(update):
+                await update
+    
+    return merge_results(chunks, aggregate)
+
+
+def merge_results(chunks: List[dict], aggregate: Optional[RuinAggregate] = None) -> dict:
+    """Concatenate run_sim results from independent chunks into one result dict."""
+    if aggregate is None:
+        aggregate = RuinAggregate.from_result(chunks[0])
+        for chunk in chunks[1:]:
+            aggregate = aggregate.merge(RuinAggregate.from_result(chunk))
+    
+    summary = aggregate.summary()
+    merged = {
+        "paths": np.concatenate([c["paths"] for c in chunks]),
+        "final_balance": np.concatenate([c["final_balance"] for c in chunks]),
+        "bankruptcy_prob": summary["bankruptcy_prob"],
+        "bankruptcy_prob_se": summary["bankruptcy_prob_se"],
+        "relative_error": summary["relative_error"],
+        "weights": np.concatenate([c["weights"] for c in chunks])
+    }
+    if aggregate.strata_counts is not None:
+        # Each chunk's weights rescale its own stratum shares; redo that for the whole run
+        counts = np.maximum(aggregate.strata_counts, 1)
+        stratum_prob = aggregate.strata_ruins / counts
+        labels = np.concatenate([c["strata"]["labels"] for c in chunks])
+        merged["weights"] = (aggregate.strata_probabilities * aggregate.n / counts)[labels]
+        merged["strata"] = {
+            "probabilities": aggregate.strata_probabilities,
+            "counts": aggregate.strata_counts,
+            "bankruptcy_prob": stratum_prob * 100,
+            "bankruptcy_prob_se": np.sqrt(stratum_prob * (1 - stratum_prob) / np.maximum(counts - 1, 1)) * 100,
+            "labels": labels
+        }
+    return merged
@@ -0,0 +1,46 @@
+"""
+Vectorized simulation of many parameter sets with the same horizon in one pass
+"""
+import numpy as np
+
+from simulation.monte_carlo import advance_balances, annual_growth
+
+
+def simulate_batch(mu: np.ndarray, sigma: np.ndarray, init_net: np.ndarray, schedules: np.ndarray,
+                   n: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Simulate R parameter sets over the same yrs years together.
+    
+    Uses the annual form of run_sim's model (see
+    simulation.monte_carlo.annual_growth); all R parameter sets share the
+    same shocks.
+    
+    Parameters:
+    -----------
+    mu, sigma, init_net : np.ndarray
+        Arrays of shape (R,): annual return, volatility (decimals) and initial net worth
+    schedules : np.ndarray
+        Withdrawals of shape (R, yrs), e.g. rows of simulation.cashflow.spending_schedule
+    n : int
+        Number of paths per parameter set
+    rng : np.random.Generator
+        Source of the shared shocks
+    
+    Returns:
+    --------
+    np.ndarray
+        Year-major balances of shape (yrs+1, R, n); ``paths[:, r].T`` is the
+        (n, yrs+1) paths array run_sim would return for parameter set r
+    """
+    mu, sigma, init_net = (np.asarray(a, dtype=float)[:, None] for a in (mu, sigma, init_net))
+    schedules = np.asarray(schedules, dtype=float)
+    rows, yrs = schedules.shape
+    
+    paths = np.empty((yrs + 1, rows, n))
+    paths[0] = init_net
+    growth = np.empty((rows, n))
+    for year in range(yrs):
+        # Growth factors of every parameter set from this year's shared shocks
+        annual_growth(mu, sigma, rng.standard_normal(n), out=growth)
+        advance_balances(paths[year], growth, schedules[:, year, None], out=paths[year + 1])
+    return paths
@@ -0,0 +1,83 @@
+"""
+Per-year cashflow schedules (pensions, lump sums, one-off expenses) for the simulation engine
+"""
+import functools
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+
+class CashflowEvent(NamedTuple):
+    """A dated cashflow in today's money.
+    
+    ``amount`` is withdrawn from the portfolio each year it applies, like
+    ``spend``; use a negative amount for income (pension, house sale).
+    It applies from ``start_year`` (0 is the first simulated year) for
+    ``years`` years, or to the end of the horizon if ``years`` is None.
+    With ``indexed`` the amount grows with inflation from year 0, as ``spend``
+    does; otherwise it is fixed in nominal terms.
+    """
+    amount: float
+    start_year: int
+    years: Optional[int] = 1
+    indexed: bool = True
+    label: str = ""
+
+
+def spending_schedule(spend: float, inflation: float, yrs: int) -> np.ndarray:
+    """run_sim's default schedule: spend grown by inflation, spend * (1 + inflation)**year."""
+    return spend * (1 + inflation) ** np.arange(yrs)
+
+
+def compile_schedule(yrs: int, inflation: float, spend: float = 0.0,
+                     events: Iterable[CashflowEvent] = ()) -> np.ndarray:
+    """
+    Compile base spending plus dated events into one per-year withdrawal array.
+    
+    Compiled schedules are cached on their inputs, so clients built from the
+    same template (same events, horizon and inflation) share one array. The
+    array is read-only for that reason; copy it before modifying.
+    
+    Parameters:
+    -----------
+    yrs : int
+        Number of years to simulate
+    inflation : float
+        Annual inflation rate (e.g., 0.03 for 3%)
+    spend : float, default=0.0
+        Base annual spending in today's money, inflated every year
+    events : iterable of CashflowEvent
+        Dated pensions, lump sums and one-off expenses; events outside the
+        horizon are ignored
+    
+    Returns:
+    --------
+    np.ndarray
+        Read-only array of shape (yrs,): net withdrawal in each year (negative
+        for a net inflow), to pass as run_sim's ``cashflows``
+    """
+    return _compile_schedule(yrs, inflation, spend, tuple(CashflowEvent(*event) for event in events))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_schedule(yrs, inflation, spend, events):
+    index = (1 + inflation) ** np.arange(yrs)
+    schedule = spend * index
+    for event in events:
+        if event.start_year < 0:
+            raise ValueError(f"Cashflow event starts before year 0: {event}")
+        end = yrs if event.years is None else min(event.start_year + event.years, yrs)
+        applies = slice(event.start_year, end)
+        schedule[applies] += event.amount * index[applies] if event.indexed else event.amount
+    schedule.setflags(write=False)
+    return schedule
+
+
+def as_schedule(cashflows, yrs: int) -> np.ndarray:
+    """Validate a per-year withdrawal array for a yrs-year run."""
+    schedule = np.asarray(cashflows, dtype=float)
+    if schedule.shape != (yrs,):
+        raise ValueError(f"cashflows must have shape ({yrs},), got {schedule.shape}")
+    if not np.all(np.isfinite(schedule)):
+        raise ValueError("cashflows must be finite")
+    return schedule
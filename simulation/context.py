@@ -0,0 +1,66 @@
+"""
+Stateful what-if simulation context: draw once per client session, re-evaluate edits cheaply
+"""
+from typing import Optional
+
+import numpy as np
+
+from simulation.cashflow import as_schedule, spending_schedule
+from simulation.monte_carlo import _ruin_summary, _simulate_paths, annual_growth
+
+
+class SimulationContext:
+    """Caches a client session's return draws so parameter edits skip the RNG.
+    
+    The first evaluation draws a (yrs, n) matrix of standardized annual
+    shocks, stored year-major to match the engine's year loop (the annual
+    form of run_sim's model, see simulation.monte_carlo.annual_growth). Growth
+    factors are cached per (mu, sigma); edits to spend, init_net or inflation
+    are a single O(n * yrs) pass over the cached matrix, edits to mu or sigma
+    add one vectorized exp, and longer horizons only draw the extra years.
+    """
+    
+    def __init__(self, n: int = 10000, seed: Optional[int] = None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.shocks = np.empty((0, n))
+        self._growth_key = None
+        self._growth = None
+    
+    def growth_factors(self, mu: float, sigma: float, yrs: int) -> np.ndarray:
+        """Return the cached (n, yrs) annual growth factors for mu and sigma (decimals)."""
+        if yrs > len(self.shocks):
+            extra = self.rng.standard_normal((yrs - len(self.shocks), self.n))
+            self.shocks = np.concatenate([self.shocks, extra])
+            self._growth_key = None
+        
+        if self._growth_key != (mu, sigma):
+            self._growth = annual_growth(mu, sigma, self.shocks)
+            self._growth_key = (mu, sigma)
+        
+        # Transposed view of the year-major cache; no copy
+        return self._growth[:yrs].T
+    
+    def evaluate(self, mu: float, sigma: float, yrs: int, init_net: float, spend: float,
+                 inflation: float, cashflows: Optional[np.ndarray] = None) -> dict:
+        """
+        Re-run the cached session with the given parameters (same units as run_sim,
+        including the optional per-year ``cashflows`` schedule).
+        
+        Returns:
+        --------
+        dict
+            Same keys as run_sim without sampling extras: "paths", "final_balance",
+            "bankruptcy_prob", "bankruptcy_prob_se", "relative_error" and "weights".
+        """
+        schedule = spending_schedule(spend, inflation, yrs) if cashflows is None else as_schedule(cashflows, yrs)
+        paths = _simulate_paths(self.growth_factors(mu, sigma, yrs), init_net, schedule)
+        final_balance = paths[:, -1]
+        weights = np.ones(self.n)
+        
+        return {
+            "paths": paths,
+            "final_balance": final_balance,
+            **_ruin_summary(final_balance, weights),
+            "weights": weights
+        }
@@ -0,0 +1,334 @@
+"""
+Coordinator/worker distributed Monte Carlo over a small length-prefixed JSON socket protocol
+
+Workers connect to the coordinator and pull shards: a shard spec carries the
+run_sim parameters, the seed stream (root seed plus shard index) and the
+global trial range. A worker answers with the shard's RuinAggregate (see
+simulation.aggregate), never paths. Each shard's draws depend only on its
+seed stream, so any worker, or two workers racing on a re-dispatched
+straggler, produce the same aggregate, and the coordinator merges them in
+shard order for a result that does not depend on scheduling.
+
+Start workers on any host with
+    python -m simulation.distributed worker --host COORDINATOR_HOST --port PORT
+"""
+import argparse
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from simulation.aggregate import RuinAggregate
+from simulation.monte_carlo import run_sim
+
+_HEADER = struct.Struct("!I")
+
+
+def _send(sock: socket.socket, message: Dict[str, Any]):
+    """Send one message: 4-byte big-endian length, then UTF-8 JSON."""
+    payload = json.dumps(message, default=lambda o: o.tolist()).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Receive one message, or None if the peer closed the connection."""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    payload = _recv_exact(sock, _HEADER.unpack(header)[0])
+    return None if payload is None else json.loads(payload.decode("utf-8"))
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+def run_shard(shard: Dict[str, Any]) -> RuinAggregate:
+    """Simulate one shard spec and return its aggregate (what a worker does per shard)."""
+    start, stop = shard["trial_range"]
+    seed = np.random.SeedSequence(shard["seed"], spawn_key=(shard["shard_id"],))
+    result = run_sim(**shard["params"], n=stop - start, rng=np.random.default_rng(seed))
+    return RuinAggregate.from_result(result)
+
+
+def run_worker(host: str, port: int) -> int:
+    """
+    Serve shards from the coordinator at (host, port) until told to stop.
+    
+    Returns:
+    --------
+    int
+        Number of shards completed
+    """
+    completed = 0
+    with socket.create_connection((host, port)) as sock:
+        _send(sock, {"type": "ready"})
+        while True:
+            message = _recv(sock)
+            if message is None or message["type"] == "stop":
+                return completed
+            
+            started = time.perf_counter()
+            try:
+                aggregate = run_shard(message)
+            except Exception as e:
+                _send(sock, {"type": "error", "job_id": message["job_id"], "shard_id": message["shard_id"],
+                             "error": repr(e)})
+                continue
+            _send(sock, {
+                "type": "result",
+                "job_id": message["job_id"],
+                "shard_id": message["shard_id"],
+                "aggregate": aggregate.to_dict(),
+                "seconds": time.perf_counter() - started
+            })
+            completed += 1
+
+
+class Coordinator:
+    """Hands out shards to connected workers and merges their aggregates.
+    
+    Listens on (host, port); port 0 picks a free port, see ``address``.
+    Workers may connect at any time and stay connected across runs. A shard
+    whose worker disconnects goes back to the queue. Once every shard has
+    been handed out, idle workers re-run shards that have been in flight
+    longer than the straggler timeout; the first result to arrive is kept.
+    """
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = socket.create_server((host, port))
+        self._server.settimeout(0.2)
+        self.address: Tuple[str, int] = self._server.getsockname()[:2]
+        
+        self._cond = threading.Condition()
+        self._closed = False
+        self._job = None
+        self._job_count = 0
+        self._threads: List[threading.Thread] = []
+        self._acceptor = threading.Thread(target=self._accept_loop, daemon=True)
+        self._acceptor.start()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+        return False
+    
+    def run(self, mu: float, sigma: float, yrs: int, init_net: float, spend: float, inflation: float,
+            n: int = 10000, shard_size: int = 2000, seed: int = 0,
+            straggler_timeout: Optional[float] = None, timeout: Optional[float] = None,
+            **sim_kwargs) -> dict:
+        """
+        Run n trials split into shards across the connected workers.
+        
+        Parameters:
+        -----------
+        mu, sigma, yrs, init_net, spend, inflation, n :
+            As for run_sim
+        shard_size : int, default=2000
+            Trials per shard (the last shard may be smaller)
+        seed : int, default=0
+            Root seed; shard k draws from SeedSequence(seed, spawn_key=(k,))
+        straggler_timeout : float, optional
+            Seconds after which an in-flight shard is re-dispatched to an idle
+            worker; by default three times the median completed shard time
+        timeout : float, optional
+            Give up (TimeoutError) if the run takes longer than this
+        **sim_kwargs :
+            JSON-serializable run_sim options (importance_shift, strata,
+            allocation, cashflows, ...)
+        
+        Returns:
+        --------
+        dict
+            The merged aggregate's summary ("bankruptcy_prob",
+            "bankruptcy_prob_se", "relative_error", "final_balance_mean") plus
+            "n", "shards", "redispatched" and "aggregate" (the RuinAggregate)
+        """
+        params = dict(mu=mu, sigma=sigma, yrs=yrs, init_net=init_net, spend=spend,
+                      inflation=inflation, **sim_kwargs)
+        bounds = list(range(0, n, shard_size)) + [n]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        with self._cond:
+            if self._job is not None:
+                raise RuntimeError("Coordinator is already running a job")
+            self._job_count += 1
+            shards = [
+                {"type": "shard", "job_id": self._job_count, "shard_id": k, "params": params,
+                 "seed": seed, "trial_range": [bounds[k], bounds[k + 1]]}
+                for k in range(len(bounds) - 1)
+            ]
+            self._job = job = {
+                "id": self._job_count,
+                "shards": shards,
+                "pending": deque(range(len(shards))),
+                "in_flight": {},
+                "results": {},
+                "durations": [],
+                "straggler_timeout": straggler_timeout,
+                "redispatched": 0,
+                "error": None
+            }
+            self._cond.notify_all()
+            try:
+                while len(job["results"]) < len(shards) and job["error"] is None:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"{len(job['results'])}/{len(shards)} shards done before timeout")
+                    self._cond.wait(remaining)
+            finally:
+                self._job = None
+        
+        if job["error"] is not None:
+            raise RuntimeError(job["error"])
+        
+        # Fixed shard order makes the floating-point sums independent of arrival order
+        aggregate = job["results"][0]
+        for k in range(1, len(shards)):
+            aggregate = aggregate.merge(job["results"][k])
+        
+        return {
+            **aggregate.summary(),
+            "n": aggregate.n,
+            "shards": len(shards),
+            "redispatched": job["redispatched"],
+            "aggregate": aggregate
+        }
+    
+    def close(self):
+        """Tell connected workers to stop and stop listening."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._acceptor.join()
+        self._server.close()
+        for thread in self._threads:
+            thread.join()
+    
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.settimeout(None)
+            thread = threading.Thread(target=self._serve_worker, args=(conn,), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+    
+    def _serve_worker(self, conn: socket.socket):
+        dispatch = None  # (job_id, shard_id, dispatch time) of the shard this worker holds
+        try:
+            with conn:
+                while True:
+                    message = _recv(conn)
+                    if message is None:
+                        return
+                    if message["type"] in ("result", "error"):
+                        self._finish(message)
+                        dispatch = None
+                    
+                    task = self._next_task()
+                    if task is None:
+                        _send(conn, {"type": "stop"})
+                        return
+                    task, started = task
+                    dispatch = (task["job_id"], task["shard_id"], started)
+                    _send(conn, task)
+        except OSError:
+            pass
+        finally:
+            if dispatch is not None:
+                self._abandon(*dispatch)
+    
+    def _next_task(self) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Block until there is a shard for this worker, returned with its dispatch time; None once closed."""
+        with self._cond:
+            while not self._closed:
+                job = self._job
+                if job is not None and job["error"] is None:
+                    if job["pending"]:
+                        shard_id = job["pending"].popleft()
+                        started = time.monotonic()
+                        job["in_flight"].setdefault(shard_id, []).append(started)
+                        return job["shards"][shard_id], started
+                    
+                    straggler = self._straggler(job)
+                    if straggler is not None:
+                        started = time.monotonic()
+                        job["in_flight"][straggler].append(started)
+                        job["redispatched"] += 1
+                        return job["shards"][straggler], started
+                # Wake up periodically to look for stragglers
+                self._cond.wait(0.05)
+            return None
+    
+    def _straggler(self, job) -> Optional[int]:
+        """Oldest in-flight shard (dispatched once) older than the straggler timeout."""
+        timeout = job["straggler_timeout"]
+        if timeout is None:
+            if not job["durations"]:
+                return None
+            timeout = 3 * float(np.median(job["durations"]))
+        now = time.monotonic()
+        candidates = [(starts[0], shard_id) for shard_id, starts in job["in_flight"].items()
+                      if len(starts) == 1 and now - starts[0] > timeout]
+        return min(candidates)[1] if candidates else None
+    
+    def _finish(self, message: Dict[str, Any]):
+        with self._cond:
+            job = self._job
+            shard_id = message["shard_id"]
+            if job is None or job["id"] != message["job_id"] or shard_id in job["results"]:
+                return  # earlier job, or the slower copy of a re-dispatched shard
+            if message["type"] == "error":
+                job["error"] = f"Shard {shard_id} failed: {message['error']}"
+            else:
+                job["results"][shard_id] = RuinAggregate.from_dict(message["aggregate"])
+                job["durations"].append(message["seconds"])
+                job["in_flight"].pop(shard_id, None)
+            self._cond.notify_all()
+    
+    def _abandon(self, job_id: int, shard_id: int, started: float):
+        """Drop the dispatch of a worker that disconnected before answering; requeue the shard if it was the only copy."""
+        with self._cond:
+            job = self._job
+            if job is None or job["id"] != job_id or shard_id in job["results"]:
+                return  # the job has finished (or moved on), or another copy already answered
+            starts = job["in_flight"].get(shard_id, [])
+            if started not in starts:
+                return
+            starts.remove(started)
+            if not starts:
+                job["in_flight"].pop(shard_id, None)
+                job["pending"].appendleft(shard_id)
+            self._cond.notify_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed Monte Carlo worker")
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    completed = run_worker(args.host, args.port)
+    print(f"Worker stopped after {completed} shards")
+
+
+if __name__ == "__main__":
+    main()
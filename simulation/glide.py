@@ -0,0 +1,250 @@
+"""
+Equity glide-path optimizer: batched evaluation of candidate allocation paths on shared draws
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from simulation.cashflow import as_schedule, spending_schedule
+from simulation.metrics import percentile_bands
+from simulation.monte_carlo import advance_balances, annual_growth
+from simulation.shared import SharedArray, attach
+
+
+class GlideDraws:
+    """Shared annual growth factors of an equity and a bond asset.
+    
+    Each asset follows the annual form of run_sim's model (see
+    simulation.monte_carlo.annual_growth), with correlated shocks. Draws are fully
+    determined by ``seed``. Stored year-major, with the
+    equity-minus-bond spread precomputed since a portfolio rebalanced
+    annually to equity weight w grows by bond + w * (equity - bond).
+    """
+    
+    def __init__(self, equity_mu: float, equity_sigma: float, bond_mu: float, bond_sigma: float,
+                 yrs: int, n: int = 5000, correlation: float = 0.0, seed: int = 0):
+        if not -1 <= correlation <= 1:
+            raise ValueError("correlation must be in [-1, 1]")
+        rng = np.random.default_rng(seed)
+        equity_shock, other_shock = rng.standard_normal((2, yrs, n))
+        bond_shock = correlation * equity_shock + np.sqrt(1 - correlation**2) * other_shock
+        
+        self.n = n
+        self.yrs = yrs
+        self.bond = annual_growth(bond_mu, bond_sigma, bond_shock, out=bond_shock)
+        self.spread = annual_growth(equity_mu, equity_sigma, equity_shock, out=equity_shock)
+        self.spread -= self.bond
+    
+    @classmethod
+    def from_arrays(cls, bond: np.ndarray, spread: np.ndarray) -> "GlideDraws":
+        """Wrap existing (yrs, n) bond growth and equity-minus-bond spread arrays, without copying."""
+        draws = cls.__new__(cls)
+        draws.yrs, draws.n = bond.shape
+        draws.bond = bond
+        draws.spread = spread
+        return draws
+    
+    def evaluate(self, weights: np.ndarray, init_net: float, schedule: np.ndarray) -> tuple:
+        """
+        Ruin probability (%) and median final balance of each candidate glide path.
+        
+        All candidates see the same draws. Balances of every
+        candidate advance together as one (candidates, n) array per year.
+        
+        Parameters:
+        -----------
+        weights : np.ndarray
+            Equity weights of shape (candidates, yrs), each in [0, 1]
+        init_net : float
+            Initial net worth
+        schedule : np.ndarray
+            Withdrawal in each of the yrs years
+        
+        Returns:
+        --------
+        tuple
+            (bankruptcy_prob, final_balance_median), arrays of shape (candidates,)
+        """
+        weights = np.atleast_2d(weights)
+        balance = np.full((len(weights), self.n), float(init_net))
+        growth = np.empty_like(balance)
+        for year in range(self.yrs):
+            np.multiply(weights[:, year, None], self.spread[year], out=growth)
+            growth += self.bond[year]
+            advance_balances(balance, growth, schedule[year], out=balance)
+        
+        bankruptcy_prob = np.mean(balance <= 0, axis=1) * 100
+        # Candidates as columns: one partition pass gives every candidate's median
+        median = percentile_bands(balance.T, (50,))["by_year"][0]
+        return bankruptcy_prob, median
+
+
+def interpolate_knots(knots: np.ndarray, yrs: int) -> np.ndarray:
+    """Expand (candidates, K) knot equity weights to (candidates, yrs) yearly weights, linearly."""
+    knots = np.atleast_2d(knots)
+    if knots.shape[1] == 1:
+        return np.repeat(knots, yrs, axis=1)
+    position = np.linspace(0, knots.shape[1] - 1, yrs)
+    lower = np.minimum(np.floor(position).astype(int), knots.shape[1] - 2)
+    fraction = position - lower
+    return knots[:, lower] * (1 - fraction) + knots[:, lower + 1] * fraction
+
+
+# Per-process state of pool workers, set once by _init_worker: shared-memory
+# handles (kept referenced so the mappings stay valid), draws and output views
+_worker_state = None
+
+
+def _init_worker(bond_spec: tuple, spread_spec: tuple, output_spec: tuple):
+    global _worker_state
+    bond_shm, bond = attach(bond_spec)
+    spread_shm, spread = attach(spread_spec)
+    output_shm, output = attach(output_spec, writable=True)
+    _worker_state = ((bond_shm, spread_shm, output_shm), GlideDraws.from_arrays(bond, spread), output)
+
+
+def _evaluate_in_worker(start: int, weights: np.ndarray, init_net: float, schedule: np.ndarray):
+    """Evaluate candidates start.. into rows 0 (ruin) and 1 (median) of the shared output."""
+    _, draws, output = _worker_state
+    output[:, start:start + len(weights)] = draws.evaluate(weights, init_net, schedule)
+
+
+def optimize_glide_path(equity_mu: float, equity_sigma: float, bond_mu: float, bond_sigma: float,
+                        yrs: int, init_net: float, spend: float, inflation: float,
+                        objective: str = "min_ruin", max_ruin: float = 5.0, knots: int = 4,
+                        n: int = 5000, correlation: float = 0.0, seed: int = 0,
+                        step: float = 0.25, min_step: float = 0.01, max_iter: int = 100,
+                        workers: Optional[int] = None,
+                        cashflows: Optional[np.ndarray] = None) -> dict:
+    """
+    Search for the equity glide path that best meets ``objective``.
+    
+    A glide path is the equity weight at ``knots`` evenly spaced points of the
+    horizon, linearly interpolated to every year (rebalanced annually, the
+    rest in bonds). The search starts from the best constant allocation on a
+    coarse grid, then runs a coordinate pattern search: each iteration
+    evaluates every knot moved by +/- ``step`` as one batch, moves to the best
+    improving candidate, and halves the step when none improves, until the
+    step falls below ``min_step``. Every evaluation uses the same shared draws.
+    
+    Parameters:
+    -----------
+    equity_mu, equity_sigma, bond_mu, bond_sigma : float
+        Annual mean return and volatility of each asset (decimals)
+    yrs, init_net, spend, inflation :
+        As for run_sim
+    objective : str, default="min_ruin"
+        "min_ruin" (minimize ruin probability, ties broken by higher median) or
+        "max_median" (maximize the median final balance subject to a ruin
+        probability of at most ``max_ruin`` percent)
+    max_ruin : float, default=5.0
+        Ruin-probability constraint (%) for "max_median"
+    knots : int, default=4
+        Number of glide-path knots (1 gives a constant allocation)
+    n : int, default=5000
+        Number of shared paths
+    correlation : float, default=0.0
+        Correlation of equity and bond annual shocks
+    seed : int, default=0
+        Seed of the shared draws
+    step, min_step : float
+        Initial and final search step in equity weight
+    max_iter : int, default=100
+        Maximum number of search iterations
+    workers : int, optional
+        Evaluate each batch across this many processes; in-process if None.
+        The draws are published once through shared memory and mapped
+        read-only by every worker, and workers write their candidates'
+        results into a shared output buffer, so tasks only carry the
+        candidate weights.
+    cashflows : array-like, optional
+        Per-year withdrawal schedule replacing spend and inflation (see run_sim)
+    
+    Returns:
+    --------
+    dict
+        Dictionary containing:
+        - "equity_weights": array of shape (yrs,), the best glide path
+        - "knots": array of shape (knots,), its knot weights
+        - "bankruptcy_prob": its ruin probability (%)
+        - "final_balance_median": its median final balance
+        - "feasible": whether it meets max_ruin (always True for "min_ruin")
+        - "evaluations", "iterations": search effort
+    """
+    if objective not in ("min_ruin", "max_median"):
+        raise ValueError(f"Unknown objective: {objective}")
+    if knots < 1:
+        raise ValueError("knots must be at least 1")
+    schedule = spending_schedule(spend, inflation, yrs) if cashflows is None else as_schedule(cashflows, yrs)
+    draws = GlideDraws(equity_mu, equity_sigma, bond_mu, bond_sigma, yrs, n, correlation, seed)
+    batch = max(11, 2 * knots)
+    
+    def score(ruin, median):
+        # Lower is better; infeasible candidates rank after all feasible ones, by ruin
+        if objective == "min_ruin":
+            return np.stack([ruin, -median])
+        infeasible = ruin > max_ruin
+        return np.stack([np.where(infeasible, 1.0, 0.0), np.where(infeasible, ruin, -median)])
+    
+    pool = None
+    shared = []
+    if workers:
+        shared = [SharedArray.publish(draws.bond), SharedArray.publish(draws.spread), SharedArray((2, batch))]
+        draws = None  # the parent evaluates nothing itself; keep one copy of the draws
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=tuple(s.spec for s in shared))
+    
+    def evaluate(candidates):
+        weights = interpolate_knots(candidates, yrs)
+        if pool is None:
+            return draws.evaluate(weights, init_net, schedule)
+        starts = np.arange(0, len(weights), -(-len(weights) // workers))
+        parts = np.split(weights, starts[1:])
+        # Results land in the shared output buffer; map only signals completion
+        list(pool.map(_evaluate_in_worker, starts, parts, [init_net] * len(parts), [schedule] * len(parts)))
+        output = shared[2].array[:, :len(weights)]
+        return output[0].copy(), output[1].copy()
+    
+    try:
+        # Coarse grid of constant allocations as the starting point
+        grid = np.repeat(np.linspace(0, 1, 11)[:, None], knots, axis=1)
+        ruin, median = evaluate(grid)
+        evaluations = len(grid)
+        best = np.lexsort(score(ruin, median)[::-1])[0]
+        current, current_ruin, current_median = grid[best], ruin[best], median[best]
+        
+        iterations = 0
+        while step >= min_step and iterations < max_iter:
+            iterations += 1
+            # Every knot moved up and down by step, clipped to [0, 1], as one batch
+            moves = np.vstack([np.eye(knots), -np.eye(knots)]) * step
+            candidates = np.clip(current + moves, 0, 1)
+            candidates = candidates[np.any(candidates != current, axis=1)]
+            if len(candidates) == 0:
+                step /= 2
+                continue
+            ruin, median = evaluate(candidates)
+            evaluations += len(candidates)
+            
+            # Best candidate, accepted only if it strictly beats the current path
+            scores = score(ruin, median)
+            best = np.lexsort(scores[::-1])[0]
+            if tuple(scores[:, best]) < tuple(score(np.array([current_ruin]), np.array([current_median]))[:, 0]):
+                current, current_ruin, current_median = candidates[best], ruin[best], median[best]
+            else:
+                step /= 2
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        for block in shared:
+            block.close()
+    
+    return {
+        "equity_weights": interpolate_knots(current, yrs)[0],
+        "knots": current,
+        "bankruptcy_prob": float(current_ruin),
+        "final_balance_median": float(current_median),
+        "feasible": bool(objective == "min_ruin" or current_ruin <= max_ruin),
+        "evaluations": evaluations,
+        "iterations": iterations
+    }
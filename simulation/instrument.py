@@ -0,0 +1,100 @@
+"""
+Phase timing and allocation instrumentation for the simulation engine
+"""
+import contextlib
+import time
+import tracemalloc
+from typing import Any, Dict
+
+import numpy as np
+
+
+class PhaseTimer:
+    """Accumulates wall time (and optionally traced memory) per named phase.
+    
+    Phases may be entered many times (e.g. once per simulated year); their
+    statistics are summed, with peak memory taken as the maximum over entries.
+    With ``trace_memory`` each phase also records, via tracemalloc:
+    - "peak_bytes": highest traced memory above the phase's starting level
+    - "allocated_bytes": net traced memory still held when the phase ends
+    - "arrays": net numpy buffers still alive when the phase ends
+    Memory tracing takes a snapshot per phase entry, so it is for diagnosis,
+    not production serving; plain timing costs two perf_counter calls per entry.
+    """
+    
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self._started_tracing = False
+        self._start = None
+        self._total = 0.0
+    
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self._total += time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+    
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block under ``name``."""
+        stats = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            arrays_before = _numpy_buffer_count()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["seconds"] += time.perf_counter() - start
+            stats["calls"] += 1
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                stats["peak_bytes"] = max(stats.get("peak_bytes", 0), peak - base)
+                stats["allocated_bytes"] = stats.get("allocated_bytes", 0) + current - base
+                stats["arrays"] = stats.get("arrays", 0) + _numpy_buffer_count() - arrays_before
+    
+    def report(self) -> Dict[str, Any]:
+        """Structured timing report: total wall time and per-phase statistics."""
+        return {
+            "total_seconds": self._total,
+            "trace_memory": self.trace_memory,
+            "phases": {name: dict(stats) for name, stats in self.phases.items()}
+        }
+
+
+class _NullTimer:
+    """Stand-in used when instrumentation is off; every phase is a no-op."""
+    
+    _null = contextlib.nullcontext()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def phase(self, name: str):
+        return self._null
+    
+    def report(self):
+        return None
+
+
+NULL_TIMER = _NullTimer()
+
+
+def _numpy_buffer_count() -> int:
+    """Number of live numpy data buffers tracked by tracemalloc."""
+    domain = np.lib.tracemalloc_domain
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.DomainFilter(True, domain)])
+    return len(snapshot.traces)
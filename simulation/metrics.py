@@ -0,0 +1,159 @@
+"""
+Shared post-processing metrics for Monte Carlo results
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def percentile_bands(paths: np.ndarray, percentiles: Sequence[float] = (10, 50, 90)) -> dict:
+    """
+    Exact percentiles of the balance for every year from a single partition pass.
+    
+    Matches np.percentile's default (linear) interpolation, but partitions each
+    year's balances once around all the order statistics the requested
+    percentiles need instead of sorting or partitioning once per percentile.
+    
+    Parameters:
+    -----------
+    paths : np.ndarray
+        Balances of shape (n, yrs+1) as returned by run_sim, or (n,) final balances
+    percentiles : sequence of float, default=(10, 50, 90)
+        Percentiles in [0, 100]; 0 and 100 give the minimum and maximum
+    
+    Returns:
+    --------
+    dict
+        Dictionary containing:
+        - "percentiles": tuple of the requested percentiles
+        - "final": dict mapping each percentile to its terminal-balance value
+        - "by_year": array of shape (len(percentiles), yrs+1) (None for 1-D input)
+    """
+    percentiles = tuple(percentiles)
+    paths = np.asarray(paths)
+    
+    # Year-major so each year's balances are partitioned along a contiguous axis;
+    # run_sim's paths are already a transposed view of a year-major buffer
+    by_year = paths.T if paths.ndim == 2 else paths[None, :]
+    n = by_year.shape[1]
+    
+    # Linear interpolation between the order statistics either side of q*(n-1)
+    position = np.asarray(percentiles, dtype=float) / 100 * (n - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, n - 1)
+    fraction = position - lower
+    
+    ordered = np.partition(by_year, np.union1d(lower, upper), axis=1)
+    low_values = ordered[:, lower]
+    values = (low_values + (ordered[:, upper] - low_values) * fraction).T
+    
+    return {
+        "percentiles": percentiles,
+        "final": {q: float(v) for q, v in zip(percentiles, values[:, -1])},
+        "by_year": values if paths.ndim == 2 else None
+    }
+
+
+def tail_metrics(paths: np.ndarray, spend: float, inflation: float, weights: Optional[np.ndarray] = None,
+                 alpha: float = 10.0, start_age: Optional[float] = None,
+                 cashflows: Optional[np.ndarray] = None) -> dict:
+    """
+    Tail-risk metrics of a run_sim result from one pass over its paths.
+    
+    Paths are ranked from worst to best: ruined paths by how early they ran
+    out (earliest first), then surviving paths by terminal balance. The worst
+    ``alpha`` percent (by weight) form the tail used for CVaR and the
+    worst-tail mean path. Shortfall counts the full years of inflation-adjusted
+    spending left unfunded after the year a path is ruined (for good), as
+    run_sim schedules it (spend * (1 + inflation)**year for year 0..yrs-1, or
+    the positive withdrawals of ``cashflows``).
+    
+    Parameters:
+    -----------
+    paths : np.ndarray
+        Balances of shape (n, yrs+1) as returned by run_sim
+    spend : float
+        Annual spending in the first year
+    inflation : float
+        Annual inflation rate as a decimal
+    weights : np.ndarray, optional
+        Per-path weights from run_sim (importance sampling / strata); equal if omitted
+    alpha : float, default=10.0
+        Tail size in percent
+    start_age : float, optional
+        Age at year 0; adds "median_ruin_age"
+    cashflows : array-like, optional
+        The per-year withdrawal schedule the paths were simulated with, if any
+    
+    Returns:
+    --------
+    dict
+        Dictionary containing:
+        - "alpha": the tail size in percent
+        - "var_final_balance": highest terminal balance within the tail
+        - "cvar_final_balance": mean terminal balance over the tail
+        - "expected_shortfall_years": mean unfunded years of spending over all paths
+        - "expected_shortfall_years_given_ruin": the same over ruined paths (None if none)
+        - "expected_shortfall_amount": mean unfunded spending over all paths
+        - "median_ruin_year": median year of ruin of ruined paths (None if none)
+        - "median_ruin_age": start_age + median_ruin_year (only with start_age)
+        - "worst_path": array of shape (yrs+1,), mean balance path of the tail
+    """
+    paths = np.asarray(paths)
+    n, yrs = paths.shape[0], paths.shape[1] - 1
+    final = paths[:, -1]
+    uniform = weights is None or np.ptp(weights) == 0
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    total_weight = weights.sum()
+    
+    # A ruined path's ruin year is the one after its last solvent year (a path can
+    # touch zero and be revived by later income, so count back from the end)
+    ruined = final <= 0
+    solvent = paths > 0
+    ruin_year = np.where(solvent.any(axis=1), yrs - np.argmax(solvent[:, ::-1], axis=1), 0) + 1
+    
+    # Worst first: ruined paths scored by ruin year (below any terminal balance)
+    score = np.where(ruined, ruin_year - (yrs + 1.0), final)
+    if uniform:
+        k = max(1, int(np.ceil(alpha / 100 * n)))
+        tail = np.argpartition(score, k - 1)[:k]
+    else:
+        order = np.argsort(score)
+        k = int(np.searchsorted(np.cumsum(weights[order]), alpha / 100 * total_weight)) + 1
+        tail = order[:min(k, n)]
+    tail_weights = weights[tail]
+    tail_total = tail_weights.sum()
+    
+    # Unfunded spending after ruin in year t: years t..yrs-1 of the schedule
+    schedule = spend * (1 + inflation) ** np.arange(yrs) if cashflows is None else np.maximum(cashflows, 0)
+    unfunded_amount = np.append(np.cumsum(schedule[::-1])[::-1], 0.0)
+    shortfall_years = np.where(ruined, yrs - ruin_year, 0)
+    shortfall_amount = np.where(ruined, unfunded_amount[np.minimum(ruin_year, yrs)], 0.0)
+    
+    ruined_weight = weights[ruined].sum()
+    if ruined_weight > 0:
+        ruin_years = ruin_year[ruined]
+        if uniform:
+            median_ruin_year = float(np.median(ruin_years))
+        else:
+            order = np.argsort(ruin_years)
+            cumulative = np.cumsum(weights[ruined][order])
+            median_ruin_year = float(ruin_years[order][np.searchsorted(cumulative, 0.5 * cumulative[-1])])
+        given_ruin = float(np.dot(weights[ruined], shortfall_years[ruined]) / ruined_weight)
+    else:
+        median_ruin_year = None
+        given_ruin = None
+    
+    metrics = {
+        "alpha": alpha,
+        "var_final_balance": float(final[tail].max()),
+        "cvar_final_balance": float(np.dot(tail_weights, final[tail]) / tail_total),
+        "expected_shortfall_years": float(np.dot(weights, shortfall_years) / total_weight),
+        "expected_shortfall_years_given_ruin": given_ruin,
+        "expected_shortfall_amount": float(np.dot(weights, shortfall_amount) / total_weight),
+        "median_ruin_year": median_ruin_year
+    }
+    if start_age is not None:
+        metrics["median_ruin_age"] = start_age + median_ruin_year if median_ruin_year is not None else None
+    metrics["worst_path"] = tail_weights @ paths[tail] / tail_total
+    return metrics
@@ -1,8 +1,18 @@
+from typing import Optional
+
 import numpy as np
 
+from simulation.cashflow import as_schedule, spending_schedule
+from simulation.instrument import NULL_TIMER, PhaseTimer
+from simulation.workspace import SimWorkspace
+
 
-def run_sim(mu: float, sigma: float, yrs: int, init_net: float, spend: float, 
-            inflation: float, n: int = 10000) -> dict:
+def run_sim(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
+            inflation: float, n: int = 10000, importance_shift: float = 0.0,
+            strata: int = 0, allocation: str = "proportional", profile: bool = False,
+            trace_memory: bool = False, rng: Optional[np.random.Generator] = None,
+            workspace: Optional[SimWorkspace] = None,
+            cashflows: Optional[np.ndarray] = None) -> dict:
     """
     Run Monte Carlo simulation for retirement planning with inflation-adjusted spending.
     
@@ -22,6 +32,43 @@ def run_sim(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
         Annual inflation rate (e.g., 0.03 for 3%)
     n : int, default=10000
         Number of simulation runs
+    importance_shift : float, default=0.0
+        Importance-sampling shift of each path's aggregate return shock toward
+        adverse outcomes, in standard deviations of that aggregate (spread
+        evenly over all draws, so the meaning does not depend on ``yrs``).
+        Paths are reweighted by their likelihood ratio so the ruin probability
+        stays unbiased. Useful for rare-event queries (``goal_pct`` of 1% or
+        less), where values around 1.5-2.5 typically tighten the estimate
+        considerably. 0 disables importance sampling.
+    strata : int, default=0
+        Number of equiprobable strata of the path's aggregate return shock.
+        Each path's total shock is drawn inside its stratum and the daily
+        shocks are filled in conditionally on it (Brownian-bridge style), so
+        the marginal model is unchanged. 0 disables stratified sampling;
+        cannot be combined with ``importance_shift``.
+    allocation : str, default="proportional"
+        How trials are spread across strata: "proportional" (equal counts)
+        or "optimal" (Neyman allocation on the per-stratum ruin std-dev
+        measured by an extra proportional pilot of max(n/10, 10*strata)
+        trials, blended half-and-half with proportional).
+    profile : bool, default=False
+        Record per-phase wall time ("setup", "rng", "compounding", "year_loop",
+        "aggregation") in a "timing" report on the result
+    trace_memory : bool, default=False
+        Also record per-phase peak/net traced memory and numpy buffers
+        (implies ``profile``; uses tracemalloc, so much slower)
+    rng : np.random.Generator, optional
+        Source of random draws. Defaults to a generator seeded from NumPy's
+        global random state, so np.random.seed still makes runs reproducible.
+    workspace : SimWorkspace, optional
+        Preallocated buffers to run in (see simulation.workspace.get_workspace
+        for a per-thread pool); the plain / importance-sampling engine then
+        allocates no path-sized arrays. The returned arrays are views into the
+        workspace and are overwritten by its next use. Ignored with ``strata``.
+    cashflows : array-like, optional
+        Net withdrawal for each of the yrs years (negative for net income), e.g.
+        from simulation.cashflow.compile_schedule; replaces ``spend`` and
+        ``inflation``, which then only matter to callers' own reporting
     
     Returns:
     --------
@@ -30,50 +77,377 @@ def run_sim(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
         - "paths": array of shape (n, yrs+1) with yearly balances for each simulation
         - "final_balance": array of shape (n,) with final balances
         - "bankruptcy_prob": probability of running out of money (as percentage)
+        - "bankruptcy_prob_se": standard error of "bankruptcy_prob" (percentage points)
+        - "relative_error": "bankruptcy_prob_se" / "bankruptcy_prob" (inf if no ruin observed)
+        - "weights": array of shape (n,) with per-path likelihood ratios
+          (all ones without importance sampling or stratification). Statistics of
+          "paths" and "final_balance" must be weighted by these to describe the nominal model.
+        - "strata": per-stratum "probabilities", "counts", "bankruptcy_prob" and
+          "bankruptcy_prob_se" arrays, and per-path stratum "labels" (only with ``strata``)
+        - "timing": PhaseTimer report (only with ``profile`` or ``trace_memory``)
     """
-    # Initialize paths array to store yearly balances
-    # Shape: (n simulations, yrs+1 time points including initial)
-    paths = np.zeros((n, yrs + 1))
-    paths[:, 0] = init_net  # Set initial balance
+    if importance_shift and sigma <= 0:
+        raise ValueError("importance_shift requires a positive sigma")
+    if strata:
+        if importance_shift:
+            raise ValueError("strata cannot be combined with importance_shift")
+        if allocation not in ("proportional", "optimal"):
+            raise ValueError(f"Unknown allocation: {allocation}")
+        if n < 2 * strata:
+            raise ValueError("n must be at least twice the number of strata")
+    
+    # Withdrawal in each year, subtracted from every path in one vectorized step
+    if cashflows is None:
+        schedule = spending_schedule(spend, inflation, yrs)
+    else:
+        schedule = as_schedule(cashflows, yrs)
+    
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2**63 - 1, dtype=np.int64))
     
-    # Generate random returns for all years and simulations at once
+    timer = PhaseTimer(trace_memory) if profile or trace_memory else NULL_TIMER
+    with timer:
+        if strata:
+            result = _run_stratified(mu, sigma, yrs, init_net, schedule, n, strata,
+                                     allocation, rng, timer)
+        else:
+            result = _run_plain(mu, sigma, yrs, init_net, schedule, n, importance_shift,
+                                rng, workspace, timer)
+    
+    if timer is not NULL_TIMER:
+        result["timing"] = timer.report()
+    return result
+
+
+def _run_plain(mu: float, sigma: float, yrs: int, init_net: float, schedule: np.ndarray,
+               n: int, importance_shift: float, rng: np.random.Generator,
+               workspace: Optional[SimWorkspace], timer) -> dict:
+    """Plain and importance-sampling branch of run_sim (see its docstring)."""
+    # Generate random returns year by year for the paths still solvent
     # Using 365-day compounding: annual return = (1 + daily_return)^365 - 1
     # For log-normal with 365-day compounding, we adjust parameters
     daily_mu = mu / 365
     daily_sigma = sigma / np.sqrt(365)
+    daily_loc = daily_mu - 0.5 * daily_sigma**2
     
-    # Generate daily log returns and compound to annual
-    daily_log_returns = np.random.normal(
-        loc=daily_mu - 0.5 * daily_sigma**2,
-        scale=daily_sigma,
-        size=(n, yrs, 365)
-    )
+    # Shifting each of the yrs*365 daily draws by importance_shift / sqrt(yrs*365)
+    # of its std-dev moves the path's total shock by importance_shift of its std-dev
+    daily_shift = importance_shift / np.sqrt(yrs * 365)
     
-    # Convert to daily returns and compound to annual
-    daily_returns = np.exp(daily_log_returns)
-    annual_returns = np.prod(daily_returns, axis=2)
+    with timer.phase("setup"):
+        # All arrays below are views into the workspace; everything is computed in place
+        ws = workspace if workspace is not None else SimWorkspace()
+        ws.ensure(n, yrs)
+        
+        # Year-major balances buffer, zero-filled so ruined paths read as 0 afterwards
+        paths = ws.paths[:yrs + 1, :n]
+        paths[0] = init_net  # Set initial balance
+        paths[1:] = 0
+        
+        # While every remaining withdrawal is positive a ruined (zero) balance stays
+        # zero, so after such years we compact the first k slots to the survivors and
+        # only draw and compound returns for them; balances are scattered back into
+        # paths by index. can_compact[year]: withdrawals after year are all positive.
+        can_compact = np.append(np.minimum.accumulate(schedule[:0:-1])[::-1] > 0, True)
+        k = n
+        active, active_next = ws.active
+        balance, balance_next = ws.balance
+        active[:n] = ws.index[:n]
+        balance[:n] = init_net
+        
+        # Per-path log growth and years drawn, for the importance-sampling weights
+        log_growth = ws.log_growth[:n]
+        log_growth[:] = 0
+        years_drawn = ws.years_drawn[:n]
     
     # Simulate year by year
     for year in range(yrs):
-        # Apply investment returns
-        paths[:, year + 1] = paths[:, year] * annual_returns[:, year]
+        # Generate daily log returns and compound to annual
+        with timer.phase("rng"):
+            daily_log_returns = ws.daily[:k]
+            rng.standard_normal(out=daily_log_returns)
+        with timer.phase("compounding"):
+            daily_log_returns *= daily_sigma
+            daily_log_returns += daily_loc - daily_shift * daily_sigma
+            daily_returns = np.exp(daily_log_returns, out=daily_log_returns)
+            annual_returns = np.prod(daily_returns, axis=1, out=ws.annual[:k])
+            if importance_shift:
+                # Accumulate log growth and years drawn for the paths that drew this year
+                path_growth = np.take(log_growth, active[:k], out=ws.scratch[:k], mode="clip")
+                path_growth += np.log(annual_returns, out=ws.daily[:k, 0])  # draws are spent
+                log_growth.put(active[:k], path_growth, mode="clip")
+                years_drawn.put(active[:k], year + 1, mode="clip")
+        
+        with timer.phase("year_loop"):
+            current = advance_balances(balance[:k], annual_returns, schedule[year], out=balance[:k])
+            paths[year + 1, active[:k]] = current
+            
+            # Drop newly ruined paths from the active set
+            if can_compact[year]:
+                solvent = np.greater(current, 0, out=ws.mask[:k])
+                survivors = np.count_nonzero(solvent)
+                if survivors < k:
+                    # Stable compaction without temporaries: a survivor moves to slot
+                    # (survivors before it), ruined paths all land in spare slot k'
+                    slot = ws.slot[:k]
+                    np.copyto(slot, solvent)
+                    np.cumsum(slot, out=slot)
+                    slot -= 1
+                    np.copyto(slot, survivors, where=np.logical_not(solvent, out=solvent))
+                    active_next.put(slot, active[:k], mode="clip")
+                    balance_next.put(slot, current, mode="clip")
+                    active, active_next = active_next, active
+                    balance, balance_next = balance_next, balance
+                    k = survivors
+    
+    with timer.phase("aggregation"):
+        # Extract final balances (a contiguous row of the year-major buffer)
+        final_balance = paths[yrs]
         
-        # Subtract inflation-adjusted spending
-        inflation_adjusted_spend = spend * ((1 + inflation) ** year)
-        paths[:, year + 1] -= inflation_adjusted_spend
+        # Likelihood ratio nominal/shifted density. For Gaussian mean shifts it
+        # depends only on the path's total standardized shock. A ruined path stops
+        # drawing, and its ratio over the years it did draw is the expectation of
+        # the full-horizon ratio given them, so the estimate stays unbiased.
+        weights = ws.weights[:n]
+        if importance_shift:
+            # log w = daily_shift * total_shock + shift^2/2 * years_drawn/yrs, in place
+            drawn = ws.scratch[:n]
+            np.copyto(drawn, years_drawn)
+            np.multiply(drawn, -365 * daily_loc, out=weights)
+            weights += log_growth
+            weights *= daily_shift / daily_sigma
+            drawn *= 0.5 * importance_shift**2 / yrs
+            weights += drawn
+            np.exp(weights, out=weights)
+        else:
+            weights[:] = 1
         
-        # Prevent negative balances from growing (bankruptcy)
-        paths[:, year + 1] = np.maximum(paths[:, year + 1], 0)
+        return {
+            # Shape (n simulations, yrs+1) view
+            "paths": paths.T,
+            "final_balance": final_balance,
+            **_ruin_summary(final_balance, weights, ws.scratch[:n], ws.mask[:n]),
+            "weights": weights
+        }
+
+
+def _ruin_summary(final_balance: np.ndarray, weights: np.ndarray, out: Optional[np.ndarray] = None,
+                  mask: Optional[np.ndarray] = None) -> dict:
+    """Weighted ruin probability with its standard and relative error (percentages).
     
-    # Extract final balances
-    final_balance = paths[:, -1]
+    ``out`` (float) and ``mask`` (bool) are optional scratch buffers of the same length.
+    """
+    n = len(final_balance)
     
-    # Calculate bankruptcy probability
-    bankruptcy_count = np.sum(final_balance <= 0)
-    bankruptcy_prob = (bankruptcy_count / n) * 100
+    # Calculate bankruptcy probability (weighted mean of the ruin indicator)
+    ruin_estimates = np.zeros(n) if out is None else out
+    ruin_estimates.fill(0)
+    np.copyto(ruin_estimates, weights, where=np.less_equal(final_balance, 0, out=mask))
+    bankruptcy_prob = ruin_estimates.mean() * 100
+    if n > 1:
+        variance = max(np.dot(ruin_estimates, ruin_estimates) - n * (bankruptcy_prob / 100)**2, 0.0) / (n - 1)
+        bankruptcy_prob_se = np.sqrt(variance / n) * 100
+    else:
+        bankruptcy_prob_se = float("inf")
+    relative_error = bankruptcy_prob_se / bankruptcy_prob if bankruptcy_prob > 0 else float("inf")
     
     return {
-        "paths": paths,
-        "final_balance": final_balance,
-        "bankruptcy_prob": bankruptcy_prob
-    }
\ No newline at end of file
+        "bankruptcy_prob": bankruptcy_prob,
+        "bankruptcy_prob_se": bankruptcy_prob_se,
+        "relative_error": relative_error
+    }
+
+
+def annual_growth(mu, sigma, shocks: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Annual growth factors exp(mu - sigma^2/2 + sigma * shock) from standard-normal shocks.
+    
+    This is the annual form of run_sim's model, shared by every engine that
+    draws one shock per path and year (SimulationContext, simulate_batch,
+    run_stress, GlideDraws). The annual log return of run_sim's 365 daily
+    steps is the sum of 365 iid normals, i.e. exactly N(mu - sigma^2/2,
+    sigma^2), so one shock per year reproduces its distribution without the
+    daily tensor. Engines that evaluate several parameter sets, scenarios or
+    allocations on the same shocks (common random numbers) compare them
+    free of sampling noise.
+    
+    mu and sigma (decimals) broadcast against shocks; ``out`` may be shocks itself.
+    """
+    growth = np.multiply(sigma, shocks, out=out)
+    growth += mu - 0.5 * np.square(sigma)
+    return np.exp(growth, out=growth)
+
+
+def advance_balances(balance: np.ndarray, growth, withdrawal, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """One year of the balance recursion: grow, withdraw, and floor at zero (ruin is absorbing).
+    
+    Arguments broadcast; pass ``out=balance`` to update in place.
+    """
+    # Apply investment returns
+    balance = np.multiply(balance, growth, out=out)
+    
+    # Subtract this year's withdrawal
+    balance -= withdrawal
+    
+    # Prevent negative balances from growing (bankruptcy)
+    return np.maximum(balance, 0, out=balance)
+
+
+def _simulate_paths(annual_returns: np.ndarray, init_net: float, schedule: np.ndarray) -> np.ndarray:
+    """Roll balances forward year by year given (n, yrs) annual growth factors and withdrawals."""
+    n, yrs = annual_returns.shape
+    
+    # Work year-major so every yearly update touches one contiguous row;
+    # a transposed view of a year-major input needs no copy here
+    growth = np.ascontiguousarray(annual_returns.T)
+    
+    # Balances buffer, shape (yrs+1 time points including initial, n simulations)
+    balances = np.empty((yrs + 1, n))
+    balances[0] = init_net  # Set initial balance
+    
+    # Simulate year by year
+    for year in range(yrs):
+        advance_balances(balances[year], growth[year], schedule[year], out=balances[year + 1])
+    
+    # Shape (n simulations, yrs+1) view
+    return balances.T
+
+
+def _run_stratified(mu: float, sigma: float, yrs: int, init_net: float, schedule: np.ndarray,
+                    n: int, strata: int, allocation: str,
+                    rng: np.random.Generator, timer=NULL_TIMER) -> dict:
+    """Stratified-sampling branch of run_sim (see its docstring)."""
+    probabilities = np.full(strata, 1.0 / strata)
+    
+    if allocation == "optimal":
+        # Separate proportional pilot to estimate each stratum's ruin std-dev. It only
+        # steers the allocation; reusing its samples would bias the estimate.
+        pilot_counts = _allocate(max(n // 10, 10 * strata), probabilities, minimum=2)
+        pilot_paths, pilot_labels = _stratified_batch(mu, sigma, yrs, init_net, schedule,
+                                                      pilot_counts, rng, timer)
+        pilot_ruined = pilot_paths[:, -1] <= 0
+        stratum_std = np.array([pilot_ruined[pilot_labels == k].std(ddof=1) for k in range(strata)])
+        
+        # Neyman allocation, blended half-and-half with proportional so a noisy
+        # pilot (or a stratum it saw as certain) cannot starve any stratum
+        neyman = probabilities * stratum_std
+        neyman = neyman / neyman.sum() if neyman.sum() > 0 else probabilities
+        shares = 0.5 * neyman + 0.5 * probabilities
+    else:
+        shares = probabilities
+    
+    paths, labels = _stratified_batch(mu, sigma, yrs, init_net, schedule,
+                                      _allocate(n, shares, minimum=2), rng, timer)
+    
+    with timer.phase("aggregation"):
+        final_balance = paths[:, -1]
+        ruined = final_balance <= 0
+        
+        # Stratum-weighted estimator: sum_k p_k * mean_k, var = sum_k p_k^2 * s_k^2 / n_k
+        counts = np.bincount(labels, minlength=strata)
+        stratum_prob = np.bincount(labels, weights=ruined, minlength=strata) / counts
+        stratum_var = stratum_prob * (1 - stratum_prob) * counts / np.maximum(counts - 1, 1)
+        stratum_se = np.sqrt(stratum_var / counts)
+        
+        bankruptcy_prob = float(np.dot(probabilities, stratum_prob)) * 100
+        bankruptcy_prob_se = float(np.sqrt(np.dot(probabilities**2, stratum_se**2))) * 100
+        relative_error = bankruptcy_prob_se / bankruptcy_prob if bankruptcy_prob > 0 else float("inf")
+        
+        return {
+            "paths": paths,
+            "final_balance": final_balance,
+            "bankruptcy_prob": bankruptcy_prob,
+            "bankruptcy_prob_se": bankruptcy_prob_se,
+            "relative_error": relative_error,
+            # Reweight each path from its sampled share n_k/n back to the stratum probability p_k
+            "weights": (probabilities * n / counts)[labels],
+            "strata": {
+                "probabilities": probabilities,
+                "counts": counts,
+                "bankruptcy_prob": stratum_prob * 100,
+                "bankruptcy_prob_se": stratum_se * 100,
+                "labels": labels
+            }
+        }
+
+
+def _stratified_batch(mu: float, sigma: float, yrs: int, init_net: float, schedule: np.ndarray,
+                      counts: np.ndarray, rng: np.random.Generator,
+                      timer=NULL_TIMER) -> tuple:
+    """Simulate counts[k] paths in each stratum k; returns (paths, stratum labels)."""
+    n = int(counts.sum())
+    n_draws = yrs * 365
+    daily_mu = mu / 365
+    daily_sigma = sigma / np.sqrt(365)
+    
+    with timer.phase("rng"):
+        # Shuffle labels so any prefix of the paths (e.g. logged sample paths) mixes strata
+        labels = np.repeat(np.arange(len(counts)), counts)
+        rng.shuffle(labels)
+        
+        # Aggregate standardized shock, stratified: S = sqrt(N) * Phi^-1((k + U) / K)
+        u = (labels + rng.uniform(size=n)) / len(counts)
+        total_shock = np.sqrt(n_draws) * _norm_ppf(u)
+        
+        # Brownian bridge to the stratified endpoint: conditional on their sum, iid
+        # normals are the sum spread evenly plus the demeaned free draws
+        shocks = rng.standard_normal(size=(n, yrs, 365))
+        shocks -= shocks.mean(axis=(1, 2), keepdims=True)
+        shocks += (total_shock / n_draws)[:, None, None]
+    
+    with timer.phase("compounding"):
+        # Same daily log-return model as run_sim, built in place
+        shocks *= daily_sigma
+        shocks += daily_mu - 0.5 * daily_sigma**2
+        np.exp(shocks, out=shocks)
+        annual_returns = np.prod(shocks, axis=2)
+    
+    with timer.phase("year_loop"):
+        paths = _simulate_paths(annual_returns, init_net, schedule)
+    
+    return paths, labels
+
+
+def _allocate(n: int, shares: np.ndarray, minimum: int = 0) -> np.ndarray:
+    """Split n trials by shares using largest remainders, with a per-stratum minimum."""
+    counts = np.full(len(shares), minimum)
+    target = shares * (n - counts.sum())
+    counts += np.floor(target).astype(int)
+    leftover = n - counts.sum()
+    counts[np.argsort(np.floor(target) - target)[:leftover]] += 1
+    return counts
+
+
+def _norm_ppf(p: np.ndarray) -> np.ndarray:
+    """Vectorized standard normal quantile (Acklam's rational approximation, ~1e-9 rel. error)."""
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00)
+    
+    p = np.clip(np.asarray(p, dtype=float), 1e-300, 1 - 1e-16)
+    x = np.empty_like(p)
+    
+    # Lower tail, central region and (by symmetry) upper tail
+    low = p < 0.02425
+    high = p > 1 - 0.02425
+    mid = ~(low | high)
+    
+    q = np.sqrt(-2 * np.log(p[low]))
+    x[low] = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / \
+             ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+    
+    q = p[mid] - 0.5
+    r = q * q
+    x[mid] = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5]) * q / \
+             (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+    
+    q = np.sqrt(-2 * np.log(1 - p[high]))
+    x[high] = -(((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / \
+              ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+    
+    return x
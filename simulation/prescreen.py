@@ -0,0 +1,83 @@
+"""
+Analytic ruin-probability pre-screen that lets obvious queries skip Monte Carlo
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+
+def approx_ruin_prob(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
+                     inflation: float) -> float:
+    """
+    Moment-matched lognormal approximation of run_sim's bankruptcy probability.
+    
+    With spending withdrawn after each year's return, the balance hits zero by
+    year ``yrs`` exactly when the stochastic present value of spending,
+    Y = sum_t spend * (1 + inflation)^t / G_{t+1} with G the compounded growth,
+    exceeds ``init_net``. Y is a sum of correlated lognormals; its first two
+    moments are closed-form, so Y is approximated by the lognormal with the same
+    mean and variance (the classic lognormal annuity approximation).
+    
+    Parameters are in run_sim units (decimals). Returns a percentage.
+    """
+    if init_net <= 0:
+        return 100.0
+    if spend <= 0 or yrs <= 0:
+        return 0.0
+    
+    # Annual log return ~ N(m, sigma^2); k-year discount exp(-S_k) has known moments
+    m = mu - 0.5 * sigma**2
+    spending = spend * (1 + inflation) ** np.arange(yrs)
+    k = np.arange(1, yrs + 1)
+    first = spending @ np.exp(-k * m + 0.5 * k * sigma**2)
+    
+    # E[exp(-S_a - S_b)] for a <= b: 2*S_a and the independent increment S_b - S_a
+    a = np.minimum.outer(k, k)
+    gap = np.abs(np.subtract.outer(k, k))
+    second = spending @ np.exp(-2 * a * m + 2 * a * sigma**2 - gap * m + 0.5 * gap * sigma**2) @ spending
+    
+    s2 = math.log(second / first**2)
+    if s2 <= 1e-12:
+        # Deterministic returns: ruin iff the present value of spending covers init_net
+        return 100.0 if first >= init_net else 0.0
+    
+    z = (math.log(init_net) - (math.log(first) - 0.5 * s2)) / math.sqrt(s2)
+    return 50.0 * math.erfc(z / math.sqrt(2))
+
+
+def prescreen(mu: float, sigma: float, yrs: int, init_net: float, spend: float,
+              inflation: float, goal_pct: float, logit_margin: float = 2.5) -> Optional[dict]:
+    """
+    Decide a query analytically when it is far from the ``goal_pct`` boundary.
+    
+    The approximation's error bound is a band of +/- ``logit_margin`` around it
+    on the log-odds scale. The default 2.5 covers the largest deviation from
+    200k-path Monte Carlo seen over a broad sweep of horizons, volatilities and
+    spending rates (the error is largest for very high ruin probabilities, and
+    below 1 when ruin is under 30%).
+    
+    Returns:
+    --------
+    dict or None
+        None when the band straddles ``goal_pct`` and full Monte Carlo is needed.
+        Otherwise a dict with:
+        - "bankruptcy_prob": approximate bankruptcy probability (percentage)
+        - "bankruptcy_prob_bounds": (low, high) error bound (percentages)
+        - "meets_goal": whether the whole band is within ``goal_pct``
+    """
+    approx = approx_ruin_prob(mu, sigma, yrs, init_net, spend, inflation)
+    
+    # Clip so certain-looking answers still get a finite band
+    p = min(max(approx / 100, 1e-12), 1 - 1e-12)
+    log_odds = math.log(p / (1 - p))
+    low, high = (100 / (1 + math.exp(-(log_odds + d))) for d in (-logit_margin, logit_margin))
+    
+    if low <= goal_pct < high:
+        return None
+    
+    return {
+        "bankruptcy_prob": approx,
+        "bankruptcy_prob_bounds": (low, high),
+        "meets_goal": high <= goal_pct
+    }
@@ -0,0 +1,320 @@
+"""
+The one simulation path behind RetireSim and the CLI pipeline: parameters in, memoized metrics out
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from simulation import prescreen
+from simulation.batch import simulate_batch
+from simulation.cashflow import as_schedule, spending_schedule
+from simulation.context import SimulationContext
+from simulation.metrics import percentile_bands, tail_metrics
+from simulation.monte_carlo import run_sim
+from simulation.workspace import get_workspace
+
+
+class SimulationService:
+    """Turns user-facing retirement parameters into metrics, memoizing by parameters.
+    
+    Parameters use the query units of the Retire signature (percentages for
+    return_mu, return_sigma and inflation). The cache key is the normalized
+    simulation inputs (horizon, rates as decimals rounded to 12 significant
+    digits, amounts, cashflow schedule and engine), so an identical question
+    in another form (7 vs 7.0, a reordered dict) is a hit. goal_pct and
+    start_age only change how a result is reported, so they are not part of
+    the key: meets_goal and median_ruin_age are derived per call.
+    
+    engine: "daily" (run_sim's 365-step engine), "annual" (simulation.batch,
+    the same model with one draw per year, vectorized across parameter sets),
+    "auto" (daily for evaluate, annual for evaluate_batch) or "warm" (one
+    SimulationContext for the service's lifetime: every evaluation reuses
+    the same annual draws, so a what-if that changes one parameter skips the
+    RNG and only re-runs the cheap yearly recursion; meant for one
+    conversation or client session per service).
+    
+    With a ``seed``, every simulation over yrs years draws from the same
+    stream, SeedSequence(seed, spawn_key=(yrs,)): a parameter set's result
+    depends only on its cache key, not on call order or its position in a
+    batch, and sets compared with each other share draws. Without one,
+    streams are seeded from NumPy's global state like run_sim, so
+    np.random.seed still makes runs reproducible.
+    """
+    
+    # Cap on the year-major balances one annual batch holds (float64 elements)
+    batch_elements = 2**24
+    
+    def __init__(self, n: int = 10000, engine: str = "auto", seed: Optional[int] = None,
+                 cache_size: int = 256, profile: bool = False):
+        if engine not in ("auto", "daily", "annual", "warm"):
+            raise ValueError(f"Unknown engine: {engine}")
+        self.n = n
+        self.engine = engine
+        self.seed = seed
+        self.cache_size = cache_size
+        self.profile = profile
+        self._cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._context = None
+        self.hits = 0
+        self.misses = 0
+    
+    def evaluate(self, params: Dict[str, Any], return_results: bool = False):
+        """
+        Metrics for one parameter set (see RetireSim.forward for the keys).
+        
+        With ``return_results`` returns (metrics, results): results is the
+        run_sim result dict, plus the full tail metrics under "tail_risk", when
+        this call simulated, and None when it was answered from the cache or
+        the pre-screen. Results from the daily engine live in this thread's
+        reusable workspace and are only valid until its next simulation.
+        """
+        normalized = self.normalize(params)
+        screened = self._prescreen(normalized)
+        if screened is not None:
+            return (screened, None) if return_results else screened
+        
+        engine = self.engine if self.engine in ("annual", "warm") else "daily"
+        key = self._key(normalized, engine)
+        cached = self._lookup(key)
+        if cached is not None:
+            metrics = self._report(cached, normalized)
+            return (metrics, None) if return_results else metrics
+        
+        if engine == "annual":
+            base, results = self._simulate_annual([normalized])[0], None
+        elif engine == "warm":
+            if self._context is None:
+                self._context = SimulationContext(n=self.n, seed=self._entropy())
+            results = self._context.evaluate(normalized['return_mu'], normalized['return_sigma'],
+                                             normalized['yrs'], normalized['init_net'], normalized['spend'],
+                                             normalized['inflation'], cashflows=normalized['cashflows'])
+            base, tail = self._metrics(normalized, results['paths'], results['weights'],
+                                       results['bankruptcy_prob'])
+            results['tail_risk'] = tail
+        else:
+            results = run_sim(
+                mu=normalized['return_mu'],
+                sigma=normalized['return_sigma'],
+                yrs=normalized['yrs'],
+                init_net=normalized['init_net'],
+                spend=normalized['spend'],
+                inflation=normalized['inflation'],
+                n=self.n,
+                rng=None if self.seed is None else np.random.default_rng(self._seed_sequence(normalized['yrs'])),
+                workspace=get_workspace(),
+                cashflows=normalized['cashflows'],
+                profile=self.profile
+            )
+            base, tail = self._metrics(normalized, results['paths'], results['weights'],
+                                       results['bankruptcy_prob'])
+            results['tail_risk'] = tail
+        self._store(key, base)
+        
+        metrics = self._report(base, normalized)
+        return (metrics, results) if return_results else metrics
+    
+    def evaluate_batch(self, batch) -> List[dict]:
+        """
+        Metrics for many parameter sets, in order.
+        
+        batch: a list of parameter dicts, or a DataFrame with one row per set
+        (missing/NaN columns take the defaults). Cached sets are answered
+        from the cache. With the annual engine the rest are grouped by yrs and
+        each group simulated as one vectorized batch sharing its draws; with
+        the daily and warm engines each set runs through evaluate.
+        """
+        if hasattr(batch, 'to_dict'):
+            batch = [{k: v for k, v in row.items() if not _is_missing(v)} for row in batch.to_dict('records')]
+        if self.engine in ("daily", "warm"):
+            return [self.evaluate(params) for params in batch]
+        
+        rows = [self.normalize(params) for params in batch]
+        results: List[Optional[dict]] = [self._prescreen(normalized) for normalized in rows]
+        
+        # Answer cached sets, and group the rest by horizon (first occurrence of each key)
+        groups: Dict[int, List[int]] = {}
+        pending: Dict[tuple, int] = {}
+        for i, normalized in enumerate(rows):
+            if results[i] is not None:
+                continue
+            key = self._key(normalized, "annual")
+            cached = self._lookup(key)
+            if cached is not None:
+                results[i] = self._report(cached, normalized)
+            elif key not in pending:
+                pending[key] = i
+                groups.setdefault(normalized['yrs'], []).append(i)
+        
+        simulated = {}
+        for yrs in sorted(groups):
+            for i, base in zip(groups[yrs], self._simulate_annual([rows[i] for i in groups[yrs]])):
+                self._store(self._key(rows[i], "annual"), base)
+                simulated[i] = base
+        
+        for i, normalized in enumerate(rows):
+            if results[i] is None:
+                results[i] = self._report(simulated[pending[self._key(normalized, "annual")]], normalized)
+        return results
+    
+    def cache_info(self) -> Dict[str, int]:
+        """Cache hits, misses and current size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+    
+    def clear_cache(self):
+        """Forget cached results (and, for the warm engine, its draws)."""
+        with self._lock:
+            self._cache.clear()
+            self._context = None
+    
+    @staticmethod
+    def normalize(params: Dict[str, Any]) -> dict:
+        """Parameters with defaults applied and percentages converted to decimals."""
+        return {
+            'yrs': int(params.get('yrs', 25)),
+            'return_mu': params.get('return_mu', 7.0) / 100.0,  # Convert percentage to decimal
+            'return_sigma': params.get('return_sigma', 15.0) / 100.0,  # Convert percentage to decimal
+            'spend': float(params.get('spend', 1000000.0)),
+            'init_net': float(params.get('init_net', 3000000.0)),
+            'inflation': params.get('inflation', 3.0) / 100.0,  # Convert percentage to decimal
+            'goal_pct': float(params.get('goal_pct', 5.0)),
+            'cashflows': params.get('cashflows'),
+            'start_age': params.get('start_age'),
+            'prescreen': params.get('prescreen', False)
+        }
+    
+    def _key(self, normalized: dict, engine: str) -> tuple:
+        if normalized['cashflows'] is not None:
+            # A schedule replaces spend and inflation entirely
+            money = ("cashflows",) + tuple(_round(v) for v in as_schedule(normalized['cashflows'], normalized['yrs']))
+        else:
+            money = (_round(normalized['spend']), _round(normalized['inflation']))
+        return (engine, self.n, self.seed, normalized['yrs'], _round(normalized['return_mu']),
+                _round(normalized['return_sigma']), _round(normalized['init_net'])) + money
+    
+    def _lookup(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+    
+    def _store(self, key: tuple, base: dict):
+        with self._lock:
+            self._cache[key] = base
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _simulate_annual(self, rows: List[dict]) -> List[dict]:
+        """Base metrics of parameter sets sharing one yrs, simulated in memory-bounded chunks."""
+        yrs = rows[0]['yrs']
+        # Every chunk restarts the same stream, so all sets see the same shocks wherever they fall
+        seed_sequence = self._seed_sequence(yrs)
+        chunk = max(1, self.batch_elements // (self.n * (yrs + 1)))
+        weights = np.ones(self.n)
+        bases = []
+        for start in range(0, len(rows), chunk):
+            members = rows[start:start + chunk]
+            paths = simulate_batch(
+                mu=[p['return_mu'] for p in members],
+                sigma=[p['return_sigma'] for p in members],
+                init_net=[p['init_net'] for p in members],
+                schedules=[self._schedule(p) for p in members],
+                n=self.n,
+                rng=np.random.default_rng(seed_sequence)
+            )
+            for j, normalized in enumerate(members):
+                member_paths = paths[:, j].T
+                bankruptcy_prob = float(np.mean(member_paths[:, -1] <= 0) * 100)
+                bases.append(self._metrics(normalized, member_paths, weights, bankruptcy_prob)[0])
+        return bases
+    
+    def _entropy(self) -> int:
+        """The service seed, or one drawn from NumPy's global state (as run_sim does)."""
+        return self.seed if self.seed is not None else int(np.random.randint(2**63 - 1, dtype=np.int64))
+    
+    def _seed_sequence(self, yrs: int) -> np.random.SeedSequence:
+        """Root of the draws of every simulation over yrs years (see the class docstring)."""
+        return np.random.SeedSequence(self._entropy(), spawn_key=(yrs,))
+    
+    @staticmethod
+    def _schedule(normalized: dict) -> np.ndarray:
+        if normalized['cashflows'] is None:
+            return spending_schedule(normalized['spend'], normalized['inflation'], normalized['yrs'])
+        return as_schedule(normalized['cashflows'], normalized['yrs'])
+    
+    @staticmethod
+    def _prescreen(normalized: dict) -> Optional[dict]:
+        """Analytic answer when requested and conclusive, else None."""
+        # Skip Monte Carlo entirely when the analytic pre-screen is conclusive
+        # (the approximation assumes a plain inflated spend, so not with cashflows)
+        if not normalized['prescreen'] or normalized['cashflows'] is not None:
+            return None
+        screened = prescreen.prescreen(normalized['return_mu'], normalized['return_sigma'], normalized['yrs'],
+                                       normalized['init_net'], normalized['spend'], normalized['inflation'],
+                                       normalized['goal_pct'])
+        if screened is None:
+            return None
+        return {
+            'bankruptcy_probability': screened['bankruptcy_prob'],
+            'meets_goal': screened['meets_goal'],
+            'bankruptcy_probability_bounds': list(screened['bankruptcy_prob_bounds']),
+            'method': 'analytic',
+            'n_simulations': 0
+        }
+    
+    def _metrics(self, normalized: dict, paths: np.ndarray, weights: np.ndarray,
+                 bankruptcy_prob: float) -> Tuple[dict, dict]:
+        """Goal-independent base metrics of one parameter set's (n, yrs+1) paths, and its tail metrics."""
+        final_balances = paths[:, -1]
+        
+        # Calculate additional metrics
+        positive_balances = final_balances[final_balances > 0]
+        bands = percentile_bands(final_balances)['final']
+        tail = tail_metrics(paths, normalized['spend'], normalized['inflation'], weights,
+                            cashflows=normalized['cashflows'])
+        
+        base = {
+            'bankruptcy_probability': float(bankruptcy_prob),
+            'median_end_balance': bands[50],
+            'mean_end_balance': float(np.mean(final_balances)),
+            'percentile_10': bands[10],
+            'percentile_90': bands[90],
+            'mean_positive_balance': float(np.mean(positive_balances)) if len(positive_balances) > 0 else 0.0,
+            'cvar_10_end_balance': tail['cvar_final_balance'],
+            'expected_shortfall_years': tail['expected_shortfall_years'],
+            'expected_shortfall_amount': tail['expected_shortfall_amount'],
+            'median_ruin_year': tail['median_ruin_year'],
+            'n_simulations': self.n
+        }
+        return base, tail
+    
+    @staticmethod
+    def _report(base: dict, normalized: dict) -> dict:
+        """A fresh metrics dict: base metrics plus the per-question goal and age fields."""
+        metrics = {
+            'bankruptcy_probability': base['bankruptcy_probability'],
+            'meets_goal': base['bankruptcy_probability'] <= normalized['goal_pct']
+        }
+        metrics.update(base)
+        if normalized['start_age'] is not None:
+            ruin_year = base['median_ruin_year']
+            metrics['median_ruin_age'] = normalized['start_age'] + ruin_year if ruin_year is not None else None
+        return metrics
+
+
+def _round(value: float) -> float:
+    """Round to 12 significant digits so float noise does not split cache keys."""
+    return float(f"{float(value):.12g}")
+
+
+def _is_missing(value) -> bool:
+    """True for None and NaN cells of a DataFrame row."""
+    return value is None or (isinstance(value, float) and np.isnan(value))
@@ -0,0 +1,62 @@
+"""
+NumPy arrays in multiprocessing.shared_memory, for zero-copy draws and outputs across a process pool
+"""
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+
+class SharedArray:
+    """An array whose buffer is a shared-memory block other processes can attach to.
+    
+    The creating process owns the block: ``close`` (or leaving the ``with``
+    block) releases and unlinks it, after which attached views in other
+    processes must no longer be used. ``spec`` is a small picklable handle
+    to send to workers instead of the data; see ``attach``.
+    """
+    
+    def __init__(self, shape, dtype=float):
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        self.spec = (self._shm.name, tuple(shape), dtype.str)
+    
+    @classmethod
+    def publish(cls, array: np.ndarray) -> "SharedArray":
+        """Copy an existing array into a new shared block."""
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+        return False
+    
+    def close(self):
+        """Release and unlink the block (drop other references to ``array`` first)."""
+        if self._shm is None:
+            return
+        del self.array
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+def attach(spec: Tuple[str, tuple, str], writable: bool = False) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Map a SharedArray's block into this process without copying.
+    
+    Returns the SharedMemory handle, which must stay referenced while the
+    view is in use, and the array view. Views are read-only unless
+    ``writable``, so workers cannot corrupt draws other workers are reading.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    view.flags.writeable = writable
+    return shm, view
@@ -0,0 +1,57 @@
+"""
+Preallocated, reusable buffers for run_sim so steady-state serving does not allocate
+"""
+import threading
+
+import numpy as np
+
+
+class SimWorkspace:
+    """Buffers for run_sim's plain / importance-sampling engine.
+    
+    Sized for up to ``n`` paths and ``yrs`` years; a call with the same or
+    smaller shape reuses them, a larger one grows them once. Results produced
+    with a workspace are views into its buffers and are overwritten by the
+    next run using the same workspace, so copy anything that must outlive it.
+    A workspace must not be used by two simulations at once; see get_workspace
+    for a per-thread pool.
+    """
+    
+    def __init__(self, n: int = 0, yrs: int = 0):
+        self.n = 0
+        self.yrs = 0
+        self.ensure(n, yrs)
+    
+    def ensure(self, n: int, yrs: int):
+        """Grow the buffers, if needed, to hold n paths over yrs years."""
+        if n <= self.n and yrs <= self.yrs:
+            return
+        n, yrs = max(n, self.n), max(yrs, self.yrs)
+        self.n, self.yrs = n, yrs
+        
+        # Year-major balances; row t holds every path's balance after year t
+        self.paths = np.empty((yrs + 1, n))
+        # One year of daily draws for the active paths
+        self.daily = np.empty((n, 365))
+        self.annual = np.empty(n)
+        self.scratch = np.empty(n)
+        self.weights = np.empty(n)
+        self.log_growth = np.empty(n)
+        self.years_drawn = np.empty(n, dtype=np.intp)
+        self.mask = np.empty(n, dtype=bool)
+        self.index = np.arange(n)
+        self.slot = np.empty(n, dtype=np.intp)
+        # Active-set compaction writes from one buffer of each pair into the other
+        self.balance = (np.empty(n), np.empty(n))
+        self.active = (np.empty(n, dtype=np.intp), np.empty(n, dtype=np.intp))
+
+
+_pool = threading.local()
+
+
+def get_workspace() -> SimWorkspace:
+    """Return this thread's reusable workspace, creating it on first use."""
+    workspace = getattr(_pool, "workspace", None)
+    if workspace is None:
+        workspace = _pool.workspace = SimWorkspace()
+    return workspace
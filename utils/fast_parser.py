@@ -0,0 +1,316 @@
+"""
+Rule-based fast path for QueryParser: deterministic extraction of the seven retirement parameters
+
+Well-formed queries state every number next to a keyword ("報酬率6%",
+"spending 800k TWD annually"), in Chinese or English. parse_query finds
+every number (with 萬/億/千/M/K multipliers, percent forms, ±, Chinese
+numerals and full-width characters), pairs numbers with field keywords in
+the same clause, and scores each field's confidence; resolve keeps the
+confident fields so the LLM is only asked about the rest.
+
+Validate against the labeled corpus with
+    python -m utils.fast_parser [data/query_corpus.jsonl]
+"""
+import json
+import re
+import sys
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+FIELDS = ("yrs", "return_mu", "return_sigma", "spend", "init_net", "inflation", "goal_pct")
+
+# Values the LLM parser fills in when a query never mentions these fields,
+# so a query that omits them can still skip the LLM
+UNSTATED_DEFAULTS = {"inflation": 3.0, "goal_pct": 5.0}
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "data" / "query_corpus.jsonl"
+
+# Field keywords; the second list holds generic words that lower confidence
+_KEYWORDS = {
+    "yrs": (r"退休|retir\w*", r""),
+    "return_mu": (r"年化報酬率?|報酬率|投資報酬|投報率?|回報率?|收益率|報酬|expected returns?|returns?|yield",
+                  r"growth|gain|earn\w*|賺"),
+    "return_sigma": (r"波動度|波動率|波動|標準差|volatility|std(?:\.|ev)?|standard deviation|sigma|σ", r"vol\b"),
+    "spend": (r"花費|花|支出|開銷|開支|生活費|提領|spend\w*|spent|expenses?|withdraw\w*|living costs?",
+              r"費用|用|need|cost"),
+    "init_net": (r"淨資產|存款|存了|存有|已存|積蓄|儲蓄|資產|本金|身價|savings|saved|net worth|nest egg|assets|initial",
+                 r"手上|有|portfolio|have|capital|with"),
+    "inflation": (r"通貨膨脹率?|通膨率?|物價上漲率?|inflation|cpi", r""),
+    "goal_pct": (r"破產機率|破產率|破產風險|失敗率|失敗機率|耗盡機率|bankruptcy|ruin|failure|run(?:ning)? out",
+                 r"risk|風險|機率"),
+}
+
+# What counts as the query stating a field; a goal needs constraint wording,
+# since nearly every query asks about the bankruptcy probability itself
+_MENTIONS = {
+    "goal_pct": r"不超過|不高於|低於|小於|以下|以內|上限|目標|可接受|容忍|below|under|less than|at most|"
+                r"no more than|max(?:imum)?|goal|target|acceptable|toleran\w*|limit"
+}
+
+_PERCENT_FIELDS = ("return_mu", "return_sigma", "inflation", "goal_pct")
+_RANGES = {
+    "yrs": (1, 100), "return_mu": (-50, 100), "return_sigma": (0, 100), "inflation": (-10, 50),
+    "goal_pct": (0, 100), "spend": (1, float("inf")), "init_net": (0, float("inf"))
+}
+
+_MULTIPLIERS = {
+    "百萬": 1e6, "千萬": 1e7, "萬": 1e4, "億": 1e8, "千": 1e3,
+    "m": 1e6, "mn": 1e6, "million": 1e6, "k": 1e3, "thousand": 1e3, "b": 1e9, "bn": 1e9, "billion": 1e9
+}
+
+_NUMBER = re.compile(
+    r"(?P<pm>±|\+/-|\+-)?\s*"
+    r"(?P<num>\d+(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)\s*"
+    r"(?P<mult>百萬|千萬|萬|億|千|million|thousand|billion|mn|bn|[mkb](?![a-z]))?\s*"
+    r"(?P<pct>%|percent\b|pct\b)?"
+    r"(?P<year>\s*(?:年|years?\b|yrs?\b))?",
+    re.IGNORECASE
+)
+_CURRENCY = re.compile(r"twd|ntd|nt\$|\$|元|台幣|新台幣|塊", re.IGNORECASE)
+# Matched against normalized text, where 一個月 and 一年 have become 1個月 and 1年
+_MONTHLY = re.compile(r"每月|每個月|月花|月支出|月開銷|(?<![\d.])1個月|monthly|per month|a month|/month|/mo\b", re.IGNORECASE)
+_ANNUAL = re.compile(r"每年|(?<![\d.])1年|年花|年支出|年開銷|annual\w*|per year|a year|yearly|/year|/yr\b", re.IGNORECASE)
+_CLAUSE = re.compile(r",(?!\d{3}(?!\d))|[;。!?\n、]")
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+_CN_NUMERAL = re.compile(r"[零〇一二兩三四五六七八九十][零〇一二兩三四五六七八九十百千]*")
+
+
+def _cn_to_int(text: str) -> int:
+    """Value of a Chinese numeral below 10000, e.g. 二十五 -> 25, 三千五 -> 3500."""
+    total, current, last_unit = 0, 0, None
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+            if current == 0:
+                last_unit = None
+        else:
+            total += (current or 1) * _CN_UNITS[ch]
+            current, last_unit = 0, _CN_UNITS[ch]
+    # Colloquial trailing digit: 三千五 is 3500, 二十五 is 25
+    return total + current * (last_unit // 10 if last_unit else 1)
+
+
+def _normalize(query: str) -> str:
+    """Full-width to ASCII, Chinese numerals to digits, 百分之X to X%."""
+    text = unicodedata.normalize("NFKC", query)
+    text = _CN_NUMERAL.sub(lambda m: str(_cn_to_int(m.group())), text)
+    return re.sub(r"百分之\s*(\d+(?:\.\d+)?)", r"\1%", text)
+
+
+def _numbers(text: str) -> List[dict]:
+    """Every number in text with its span, value and kind ("percent", "money", "year" or "bare")."""
+    found = []
+    for m in _NUMBER.finditer(text):
+        value = float(m.group("num").replace(",", ""))
+        mult = m.group("mult")
+        if mult:
+            value *= _MULTIPLIERS[mult.lower()]
+        start, end = m.span()
+        if m.group("pct"):
+            kind = "percent"
+        elif m.group("year") and not mult:
+            kind = "year"
+        elif mult or _CURRENCY.search(text[max(0, start - 4):end + 5]):
+            kind = "money"
+        else:
+            kind = "bare"
+        # 1億2000萬 and 1萬5千 are one amount
+        if (found and mult and found[-1]["end"] == start and found[-1]["mult"] in ("億", "萬")
+                and value < _MULTIPLIERS[found[-1]["mult"]] and kind == "money"):
+            found[-1].update(value=found[-1]["value"] + value, end=end)
+            continue
+        # Either end of a range ("5%到7%", "5-7%") is no single value
+        in_range = bool(found) and re.fullmatch(r"\s*(?:到|至|~|-|–|to)\s*", text[found[-1]["end"]:start], re.IGNORECASE)
+        if in_range:
+            found[-1]["range"] = True
+        found.append({"start": start, "end": end, "value": value, "kind": kind,
+                      "mult": mult, "pm": bool(m.group("pm")), "range": bool(in_range)})
+    return found
+
+
+def _compatible(field: str, number: dict) -> Optional[float]:
+    """Base confidence of number as a value of field, or None if its kind rules it out."""
+    kind = number["kind"]
+    if number["range"]:
+        return None
+    if number["pm"]:
+        return 1.0 if field == "return_sigma" else None
+    if field == "yrs":
+        return 1.0 if kind == "year" and number["value"] == int(number["value"]) else None
+    if field in _PERCENT_FIELDS:
+        return {"percent": 1.0, "bare": 0.6}.get(kind)
+    if kind == "money":
+        return 1.0
+    if kind == "bare" and number["value"] >= 1000:
+        return 0.9
+    return None
+
+
+def parse_query(query: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract the QueryParser fields from a natural-language query without an LLM.
+    
+    Each number is paired with the closest keyword of a compatible field in
+    the same clause; pairs are assigned greedily, most confident and closest
+    first, so each number and each field is used once.
+    
+    Parameters:
+    -----------
+    query : str
+        Retirement planning query in Chinese or English
+    
+    Returns:
+    --------
+    dict
+        For every field in FIELDS: {"value", "confidence", "text", "mentioned"},
+        with value in QueryParser's units (percentages as e.g. 7.0, amounts in
+        TWD, a monthly spend converted to annual), confidence in [0, 1] (0 when
+        no value was found), the matched text, and whether any keyword of the
+        field appears in the query at all
+    """
+    text = _normalize(query)
+    numbers = _numbers(text)
+    clauses = [0] + [m.end() for m in _CLAUSE.finditer(text)] + [len(text) + 1]
+    
+    def clause_of(position):
+        return next(i for i in range(len(clauses) - 1) if clauses[i] <= position < clauses[i + 1])
+    
+    candidates = []
+    for field, (strong, weak) in _KEYWORDS.items():
+        for pattern, weight in ((strong, 1.0), (weak, 0.9)):
+            if not pattern:
+                continue
+            for keyword in re.finditer(pattern, text, re.IGNORECASE):
+                clause = clause_of(keyword.start())
+                for index, number in enumerate(numbers):
+                    base = _compatible(field, number)
+                    if base is None or clause_of(number["start"]) != clause:
+                        continue
+                    distance = max(keyword.start() - number["end"], number["start"] - keyword.end(), 0)
+                    confidence = base * weight * (0.9 if distance > 12 else 1.0)
+                    candidates.append((-confidence, distance, field, index))
+    
+    # "7% ±12%" states the volatility even without a keyword
+    for index, number in enumerate(numbers):
+        if number["pm"] and number["kind"] == "percent":
+            candidates.append((-1.0, 0, "return_sigma", index))
+    
+    # A "N years" figure in a clause without a retirement keyword is a weak guess
+    year_numbers = [i for i, number in enumerate(numbers) if number["kind"] == "year"]
+    if len(year_numbers) == 1:
+        candidates.append((-0.7, 99, "yrs", year_numbers[0]))
+    
+    result = {
+        field: {"value": None, "confidence": 0.0, "text": None,
+                "mentioned": bool(re.search(_MENTIONS.get(field, _KEYWORDS[field][0]), text, re.IGNORECASE))}
+        for field in FIELDS
+    }
+    used = set()
+    for negative_confidence, _, field, index in sorted(candidates):
+        if result[field]["value"] is not None or index in used:
+            continue
+        number = numbers[index]
+        value, confidence = number["value"], -negative_confidence
+        if field == "spend":
+            clause = text[clauses[clause_of(number["start"])]:clauses[clause_of(number["start"]) + 1]]
+            if _MONTHLY.search(clause) and not _ANNUAL.search(clause):
+                value *= 12
+        low, high = _RANGES[field]
+        if not low <= value <= high:
+            continue
+        used.add(index)
+        result[field].update(value=int(value) if field == "yrs" else value, confidence=confidence,
+                             text=text[number["start"]:number["end"]].strip())
+    return result
+
+
+def resolve(parsed: Dict[str, Dict[str, Any]], threshold: float = 0.8) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Split a parse_query result into confident values and fields left for the LLM.
+    
+    Fields in UNSTATED_DEFAULTS that the query never mentions take their
+    default, as the LLM parser would; a mentioned field without a confident
+    value is left unresolved.
+    
+    Returns:
+    --------
+    tuple
+        (params, unresolved): {field: value} of resolved fields, and the list
+        of unresolved field names (empty when the LLM can be skipped)
+    """
+    params, unresolved = {}, []
+    for field in FIELDS:
+        entry = parsed[field]
+        if entry["value"] is not None and entry["confidence"] >= threshold:
+            params[field] = entry["value"]
+        elif field in UNSTATED_DEFAULTS and not entry["mentioned"] and entry["value"] is None:
+            params[field] = UNSTATED_DEFAULTS[field]
+        else:
+            unresolved.append(field)
+    return params, unresolved
+
+
+def validate(corpus_path=DEFAULT_CORPUS, threshold: float = 0.8) -> dict:
+    """
+    Score the fast path on a labeled corpus (JSONL of {"query", "expected"}).
+    
+    "expected" maps every field to its true value; a resolved value counts
+    as correct within a relative tolerance of 1e-6.
+    
+    Returns:
+    --------
+    dict
+        - "queries": corpus size
+        - "fully_resolved": fraction of queries needing no LLM call
+        - "fully_resolved_correct": fraction resolved with every field correct
+        - "field_precision": correct / resolved, over all fields
+        - "by_field": {field: {"coverage", "precision"}}
+        - "errors": [(query, field, got, expected)] for every wrong resolved value
+    """
+    rows = [json.loads(line) for line in Path(corpus_path).read_text(encoding="utf-8").splitlines() if line.strip()]
+    by_field = {field: {"resolved": 0, "correct": 0} for field in FIELDS}
+    fully_resolved = fully_correct = 0
+    errors = []
+    for row in rows:
+        params, unresolved = resolve(parse_query(row["query"]), threshold)
+        all_correct = True
+        for field, value in params.items():
+            expected = row["expected"][field]
+            correct = abs(value - expected) <= 1e-6 * max(1.0, abs(expected))
+            by_field[field]["resolved"] += 1
+            by_field[field]["correct"] += correct
+            if not correct:
+                all_correct = False
+                errors.append((row["query"], field, value, expected))
+        if not unresolved:
+            fully_resolved += 1
+            fully_correct += all_correct
+    
+    resolved = sum(stats["resolved"] for stats in by_field.values())
+    return {
+        "queries": len(rows),
+        "fully_resolved": fully_resolved / len(rows),
+        "fully_resolved_correct": fully_correct / len(rows),
+        "field_precision": sum(stats["correct"] for stats in by_field.values()) / resolved if resolved else 1.0,
+        "by_field": {
+            field: {"coverage": stats["resolved"] / len(rows),
+                    "precision": stats["correct"] / stats["resolved"] if stats["resolved"] else 1.0}
+            for field, stats in by_field.items()
+        },
+        "errors": errors
+    }
+
+
+if __name__ == "__main__":
+    report = validate(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CORPUS)
+    print(f"Queries: {report['queries']}")
+    print(f"Fully resolved (no LLM call): {report['fully_resolved']:.0%}, "
+          f"all fields correct: {report['fully_resolved_correct']:.0%}")
+    print(f"Field precision: {report['field_precision']:.1%}")
+    for field, stats in report["by_field"].items():
+        print(f"  {field:<13} coverage {stats['coverage']:.0%}  precision {stats['precision']:.0%}")
+    for query, field, got, expected in report["errors"]:
+        print(f"  WRONG {field}: got {got}, expected {expected} in {query!r}")
@@ -0,0 +1,211 @@
+"""
+Persistent SQLite cache of LM responses for dspy predictors, shared across processes
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import dspy
+
+# Default cache file: logs/ at the repository root, whatever the working directory
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "logs" / "lm_cache.sqlite"
+
+
+class LMCache:
+    """SQLite-backed store of predictor outputs, keyed by a hash of everything that shapes the prompt.
+    
+    Entries expire ``ttl`` seconds after they were written; once the store
+    holds more than ``max_entries``, the least recently used are evicted.
+    The database runs in WAL mode with a busy timeout and every write is
+    its own short transaction, so several processes (CLI runs, demos,
+    workers) can share one file.
+    """
+    
+    def __init__(self, path: str = str(DEFAULT_CACHE_PATH), ttl: Optional[float] = 7 * 24 * 3600,
+                 max_entries: int = 10000, timeout: float = 30.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, signature TEXT, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+    
+    def _connect(self) -> "_Closing":
+        # One short-lived connection per operation: safe across threads and
+        # processes, and cheap next to an LM round trip
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return _Closing(conn)
+    
+    @staticmethod
+    def make_key(model: str, signature: str, demos: Any, prompt: Any) -> str:
+        """SHA-256 of the model, signature, demos and rendered prompt (JSON-serialized)."""
+        payload = json.dumps([model, signature, demos, prompt], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached value of key, or None if absent or expired."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+    
+    def set(self, key: str, value: Dict[str, Any], model: str = "", signature: str = ""):
+        """Store value under key, then drop expired and least recently used entries over the limit."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, signature, value, created, accessed, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, model, signature, json.dumps(value, ensure_ascii=False, default=str), now, now)
+                )
+                if self.ttl is not None:
+                    conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM responses WHERE key IN"
+                        " (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+    
+    def stats(self) -> dict:
+        """This process's hits/misses/hit_rate and the store's entry count and lifetime hits."""
+        with self._connect() as conn:
+            entries, stored_hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "lifetime_hits": stored_hits
+        }
+
+
+class _Closing:
+    """Context manager that closes (not just commits) a sqlite3 connection."""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+    
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+    
+    def __exit__(self, *exc):
+        self.conn.close()
+        return False
+
+
+class CachedModule(dspy.Module):
+    """Wrap a dspy predictor (Predict, ChainOfThought, or a module of them) with an LMCache.
+    
+    The key covers the LM (model name and generation kwargs), each inner
+    predictor's signature and demos, and the prompt the current adapter
+    renders for the inputs, so editing a field description, compiling new
+    demos or switching models never returns a stale answer. A hit returns a
+    dspy.Prediction of the cached output fields without calling the LM.
+    Hits record nothing in dspy's trace, so compile the unwrapped module and
+    wrap the compiled one for inference.
+    
+    Usage:
+        parser = CachedModule(dspy.ChainOfThought(QueryParser), LMCache(), logger=get_logger())
+        parsed = parser(query="...")
+    """
+    
+    def __init__(self, module: dspy.Module, cache: Optional[LMCache] = None, logger=None, name: Optional[str] = None):
+        super().__init__()
+        self.module = module
+        self.cache = cache if cache is not None else LMCache()
+        self.logger = logger
+        self.name = name or type(module).__name__
+    
+    def forward(self, **inputs):
+        model, signature, key = self._describe(inputs)
+        started = time.perf_counter()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._log(True, key, started)
+            return dspy.Prediction(**cached)
+        
+        prediction = self.module(**inputs)
+        self.cache.set(key, prediction.toDict(), model=model, signature=signature)
+        self._log(False, key, started)
+        return prediction
+    
+    def _describe(self, inputs: Dict[str, Any]) -> tuple:
+        """(model, signature names, cache key) for a call with these inputs."""
+        lm = dspy.settings.lm
+        parts = []
+        for name, predictor in self.module.named_predictors():
+            lm = predictor.lm or lm
+            demos = [demo.toDict() if hasattr(demo, "toDict") else dict(demo) for demo in predictor.demos]
+            parts.append({
+                "name": name,
+                "signature": signature_spec(predictor.signature),
+                "demos": demos,
+                "prompt": _render(predictor.signature, demos, inputs)
+            })
+        model = getattr(lm, "model", str(lm))
+        lm_kwargs = getattr(lm, "kwargs", {})
+        signature = ",".join(predictor.signature.__name__ for _, predictor in self.module.named_predictors())
+        key = LMCache.make_key(
+            json.dumps([model, lm_kwargs], sort_keys=True, default=str), signature,
+            [(part["name"], part["signature"], part["demos"]) for part in parts],
+            [part["prompt"] for part in parts]
+        )
+        return model, signature, key
+    
+    def _log(self, hit: bool, key: str, started: float):
+        if self.logger is not None:
+            self.logger.log_lm_cache(self.name, hit, key, (time.perf_counter() - started) * 1000)
+
+
+def signature_spec(signature) -> dict:
+    """Instructions and field names/descriptions of a signature, for hashing."""
+    fields = {}
+    for group, container in (("input", signature.input_fields), ("output", signature.output_fields)):
+        for name, field in container.items():
+            extra = getattr(field, "json_schema_extra", None) or {}
+            fields[name] = [group, extra.get("desc"), str(getattr(field, "annotation", ""))]
+    return {"instructions": signature.instructions, "fields": fields}
+
+
+def _render(signature, demos, inputs):
+    """Messages the configured adapter would send; the raw inputs if rendering fails."""
+    adapter = dspy.settings.adapter or dspy.ChatAdapter()
+    try:
+        return adapter.format(signature, demos, inputs)
+    except Exception:
+        return inputs
@@ -0,0 +1,140 @@
+"""
+Per-call LM token and latency accounting through dspy callbacks
+"""
+import contextlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+from utils.logger import summarize_lm_calls
+
+
+class LMUsageTracker(BaseCallback):
+    """Record every LM call dspy modules make: model, tokens, latency, cache hit and retries.
+    
+    Each call is attributed to the signature of the innermost Predict that
+    made it and to a step: the name set with ``step()``, or else the
+    outermost module's class. A second LM call within one Predict call
+    (e.g. an adapter falling back after a parse failure) counts as a retry.
+    Token counts come from the LM's history entry, so they are missing when
+    dspy history is disabled; calls answered from dspy's own LM cache are
+    marked as cache hits. Records go to ``logger.log_lm_call`` when a logger
+    is given and are kept in ``calls`` either way.
+    
+    Usage:
+        tracker = track_lm_usage(get_logger())
+        with tracker.step("parsing"):
+            parsed = parser(query=query)
+    """
+    
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lm_calls_per_module: Dict[str, int] = {}
+    
+    def _stack(self) -> list:
+        if not hasattr(self._local, "modules"):
+            self._local.modules = []
+            self._local.steps = []
+        return self._local.modules
+    
+    @contextlib.contextmanager
+    def step(self, name: str):
+        """Attribute LM calls made in this block (in this thread) to step ``name``."""
+        self._stack()
+        self._local.steps.append(name)
+        try:
+            yield self
+        finally:
+            self._local.steps.pop()
+    
+    def on_module_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]):
+        signature = getattr(instance, "signature", None)
+        self._stack().append((call_id, type(instance).__name__, getattr(signature, "__name__", None)))
+    
+    def on_module_end(self, call_id: str, outputs: Optional[Any], exception: Optional[Exception] = None):
+        stack = self._stack()
+        if stack and stack[-1][0] == call_id:
+            stack.pop()
+        with self._lock:
+            self._lm_calls_per_module.pop(call_id, None)
+    
+    def on_lm_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]):
+        stack = self._stack()
+        predictor = next((frame for frame in reversed(stack) if frame[2] is not None), None)
+        step = self._local.steps[-1] if self._local.steps else (stack[0][1] if stack else None)
+        with self._lock:
+            attempt = 0
+            if predictor is not None:
+                attempt = self._lm_calls_per_module.get(predictor[0], 0)
+                self._lm_calls_per_module[predictor[0]] = attempt + 1
+            self._pending[call_id] = {
+                "instance": instance,
+                "messages": inputs.get("messages"),
+                "prompt": inputs.get("prompt"),
+                "started": time.perf_counter(),
+                "model": getattr(instance, "model", type(instance).__name__),
+                "signature": predictor[2] if predictor else None,
+                "step": step,
+                "retries": attempt
+            }
+    
+    def on_lm_end(self, call_id: str, outputs: Optional[Any], exception: Optional[Exception] = None):
+        with self._lock:
+            pending = self._pending.pop(call_id, None)
+        if pending is None:
+            return
+        latency_ms = (time.perf_counter() - pending["started"]) * 1000
+        entry = _history_entry(pending["instance"], pending["messages"], pending["prompt"])
+        usage = dict(entry.get("usage") or {}) if entry else {}
+        cache_hit = getattr(entry.get("response"), "cache_hit", None) if entry else None
+        if cache_hit is None and entry:
+            cache_hit = not usage
+        
+        record = {
+            "timestamp": time.time(),
+            "model": pending["model"],
+            "signature": pending["signature"],
+            "step": pending["step"],
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "latency_ms": latency_ms,
+            "cache_hit": bool(cache_hit),
+            "retries": pending["retries"],
+            "cost": entry.get("cost") if entry else None,
+            "error": None if exception is None else f"{type(exception).__name__}: {exception}"
+        }
+        with self._lock:
+            self.calls.append(record)
+        if self.logger is not None:
+            self.logger.log_lm_call(record)
+    
+    def summary(self) -> Dict[str, Any]:
+        """Aggregates over every recorded call (see utils.logger.summarize_lm_calls)."""
+        with self._lock:
+            return summarize_lm_calls(list(self.calls))
+
+
+def _history_entry(lm: Any, messages: Any, prompt: Any) -> Optional[dict]:
+    """The LM history entry of a call, matched by its messages, newest first."""
+    history = getattr(lm, "history", None) or []
+    for entry in reversed(history[-50:]):
+        if messages is not None and (entry.get("messages") is messages or entry.get("messages") == messages):
+            return entry
+        if messages is None and prompt is not None and entry.get("prompt") == prompt:
+            return entry
+    return None
+
+
+def track_lm_usage(logger=None) -> LMUsageTracker:
+    """Register an LMUsageTracker with dspy (alongside existing callbacks) and return it."""
+    tracker = LMUsageTracker(logger)
+    callbacks = list(getattr(dspy.settings, "callbacks", None) or [])
+    dspy.configure(callbacks=callbacks + [tracker])
+    return tracker
@@ -25,6 +25,15 @@ class ExperimentLogger:
         self.entries = []
         self.current_entry = None
         
+        # Session-wide LM cache lookups (see utils.lm_cache)
+        self.lm_cache_stats = {"hits": 0, "misses": 0}
+        
+        # Every LM call of the session (see utils.lm_usage)
+        self.lm_calls = []
+        
+        # Tiers tried and accepted per parse (see pipeline.cascade)
+        self.cascade_outcomes = []
+    
     def start_query(self, query: str, source: str = "cli"):
         """Start tracking a new query"""
         self.current_entry = {
@@ -40,15 +49,23 @@ class ExperimentLogger:
             "duration_ms": None
         }
         self.start_time = datetime.datetime.now()
+    
+    def log_parsing(self, parsed_params: Dict[str, Any], raw_response: Optional[str] = None,
+                    fast_path: Optional[Dict[str, Any]] = None):
+        """Log the parsing phase results
         
-    def log_parsing(self, parsed_params: Dict[str, Any], raw_response: Optional[str] = None):
-        """Log the parsing phase results"""
+        fast_path: rule-based parser outcome (fields left to the LLM and
+        per-field confidence), logged when given; raw_response is None when
+        the LLM was not called
+        """
         if self.current_entry:
             self.current_entry["intermediate"]["parsing"] = {
                 "timestamp": datetime.datetime.now().isoformat(),
                 "parsed_params": parsed_params,
                 "raw_llm_response": raw_response
             }
+            if fast_path is not None:
+                self.current_entry["intermediate"]["parsing"]["fast_path"] = fast_path
     
     def log_monte_carlo_start(self, params: Dict[str, Any]):
         """Log Monte Carlo simulation parameters"""
@@ -60,9 +77,20 @@ class ExperimentLogger:
                 "results": None
             }
     
-    def log_monte_carlo_results(self, results: Dict[str, Any]):
-        """Log Monte Carlo simulation results"""
+    def log_monte_carlo_results(self, results: Dict[str, Any], bands: Optional[Dict[str, Any]] = None,
+                                tail: Optional[Dict[str, Any]] = None):
+        """Log Monte Carlo simulation results
+        
+        bands: output of simulation.metrics.percentile_bands over results["paths"]
+        including percentiles 0, 50 and 100; computed here if not given
+        tail: output of simulation.metrics.tail_metrics, logged when given
+        """
         if self.current_entry:
+            from simulation.metrics import percentile_bands
+            if bands is None:
+                bands = percentile_bands(results["paths"], (0, 10, 50, 90, 100))
+            final_bands = bands["final"]
+            
             mc_data = self.current_entry["intermediate"].get("monte_carlo", {})
             mc_data.update({
                 "end_timestamp": datetime.datetime.now().isoformat(),
@@ -70,15 +98,29 @@ class ExperimentLogger:
                     "bankruptcy_prob": float(results["bankruptcy_prob"]),
                     "final_balance_stats": {
                         "mean": float(results["final_balance"].mean()),
-                        "median": float(results["final_balance"][results["final_balance"] > 0].mean()) if any(results["final_balance"] > 0) else 0,
+                        "median": final_bands[50],
                         "std": float(results["final_balance"].std()),
-                        "min": float(results["final_balance"].min()),
-                        "max": float(results["final_balance"].max())
+                        "min": final_bands[0],
+                        "max": final_bands[100]
                     },
                     "n_simulations": len(results["final_balance"])
+                },
+                # Yearly balance percentiles over all paths, e.g. for fan charts
+                "percentile_bands": {
+                    str(q): band.tolist() for q, band in zip(bands["percentiles"], bands["by_year"])
                 }
             })
             
+            # Tail-risk metrics, with the worst-tail mean path as a plain list
+            if tail is not None:
+                mc_data["results"]["tail_risk"] = {
+                    key: value.tolist() if key == "worst_path" else value for key, value in tail.items()
+                }
+            
+            # Per-phase timing report when the simulation ran with profile/trace_memory
+            if results.get("timing"):
+                mc_data["timing"] = results["timing"]
+            
             # Save sample paths for visualization (first 100)
             import numpy as np
             sample_paths = results["paths"][:100].tolist() if len(results["paths"]) > 100 else results["paths"].tolist()
@@ -115,6 +157,40 @@ class ExperimentLogger:
                 "message": message
             })
     
+    def log_lm_cache(self, module: str, hit: bool, key: str, latency_ms: float):
+        """Log one LM cache lookup; hits and misses are also counted for the session summary"""
+        self.lm_cache_stats["hits" if hit else "misses"] += 1
+        if self.current_entry:
+            calls = self.current_entry["intermediate"].setdefault("lm_cache", [])
+            calls.append({
+                "timestamp": datetime.datetime.now().isoformat(),
+                "module": module,
+                "hit": hit,
+                "key": key,
+                "latency_ms": latency_ms
+            })
+    
+    def log_lm_call(self, call: Dict[str, Any]):
+        """Log one LM call: model, signature, step, tokens, latency, cache hit, retries"""
+        call = {**call, "timestamp": datetime.datetime.now().isoformat()}
+        self.lm_calls.append(call)
+        if self.current_entry:
+            self.current_entry["intermediate"].setdefault("lm_calls", []).append(call)
+    
+    def log_cascade(self, result: Dict[str, Any]):
+        """Log one parser cascade run: the tiers tried, their problems, and the accepted tier"""
+        self.cascade_outcomes.append({
+            "tier": result["tier"],
+            "attempts": [attempt["tier"] for attempt in result["attempts"]]
+        })
+        if self.current_entry:
+            self.current_entry["intermediate"].setdefault("cascade", []).append(result)
+    
+    def lm_cache_summary(self) -> Dict[str, Any]:
+        """Session LM cache hits, misses and hit rate"""
+        lookups = self.lm_cache_stats["hits"] + self.lm_cache_stats["misses"]
+        return {**self.lm_cache_stats, "hit_rate": self.lm_cache_stats["hits"] / lookups if lookups else 0.0}
+    
     def log_step(self, step_info: Dict[str, Any]):
         """Log a step in the demonstration process"""
         if self.current_entry:
@@ -165,6 +241,10 @@ class ExperimentLogger:
     def save_entry(self):
         """Save the current entry to file"""
         if self.current_entry:
+            # LM time and tokens of this query, next to its total duration
+            if self.current_entry["intermediate"].get("lm_calls"):
+                self.current_entry["lm_usage"] = summarize_lm_calls(self.current_entry["intermediate"]["lm_calls"])
+            
             # Append to JSONL file with Chinese characters preserved
             with open(self.session_file, "a", encoding='utf-8') as f:
                 f.write(json.dumps(self.current_entry, ensure_ascii=False, indent=None) + "\n")
@@ -186,6 +266,9 @@ class ExperimentLogger:
             "successful_queries": len([e for e in self.entries if not e["errors"]]),
             "failed_queries": len([e for e in self.entries if e["errors"]]),
             "average_duration_ms": sum(e["duration_ms"] for e in self.entries if e["duration_ms"]) / len(self.entries) if self.entries else 0,
+            "lm_cache": self.lm_cache_summary(),
+            "lm_usage": summarize_lm_calls(self.lm_calls),
+            "cascade": summarize_cascade(self.cascade_outcomes),
             "queries": [
                 {
                     "id": e["id"],
@@ -216,6 +299,14 @@ class ExperimentLogger:
                 "success": len(entry["errors"]) == 0
             }
             
+            # LM share of the query's time and its tokens
+            if entry.get("lm_usage"):
+                row.update({
+                    "lm_calls": entry["lm_usage"]["calls"],
+                    "lm_latency_ms": entry["lm_usage"]["latency_ms"]["total"],
+                    "lm_tokens": entry["lm_usage"]["total_tokens"]
+                })
+            
             # Add parsed parameters
             if "parsing" in entry["intermediate"]:
                 params = entry["intermediate"]["parsing"]["parsed_params"]
@@ -227,7 +318,9 @@ class ExperimentLogger:
                 row.update({
                     "bankruptcy_prob": entry["output"].get("bankruptcy_probability"),
                     "meets_goal": entry["output"].get("meets_goal"),
-                    "final_balance_mean": entry["output"].get("final_balance_mean")
+                    "final_balance_mean": _mean_end_balance(entry["output"]),
+                    "cvar_final_balance": entry["output"].get("cvar_10_end_balance"),
+                    "expected_shortfall_years": entry["output"].get("expected_shortfall_years")
                 })
             
             rows.append(row)
@@ -246,6 +339,10 @@ class ExperimentLogger:
         if not df.empty and 'duration_ms' in df.columns:
             avg_time = f"{df['duration_ms'].mean():.0f}ms"
         
+        lm_usage = summarize_lm_calls(self.lm_calls)
+        cascade = summarize_cascade(self.cascade_outcomes)
+        cascade_tiers = ", ".join(f"{name} {stats['share']:.0%}" for name, stats in cascade["tiers"].items()) or "N/A"
+        
         report = f"""# Retirement Planning Session Report
 Session ID: {self.session_id}
 Generated: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
@@ -255,15 +352,23 @@ Generated: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
 - Successful: {len([e for e in self.entries if not e["errors"]])}
 - Failed: {len([e for e in self.entries if e["errors"]])}
 - Average Processing Time: {avg_time}
+- LM Calls: {lm_usage["calls"]} ({lm_usage["total_tokens"]} tokens, {lm_usage["latency_ms"]["total"]:.0f}ms)
+- LM Cache Hit Rate: {self.lm_cache_summary()["hit_rate"]:.0%} ({self.lm_cache_stats["hits"]} of {self.lm_cache_stats["hits"] + self.lm_cache_stats["misses"]} lookups)
+- Parses Accepted per Cascade Tier: {cascade_tiers}
 
 ## Query Details
 """
-        
+
         for entry in self.entries:
             report += f"\n### Query {entry['id']}: {entry['input']['raw_query']}\n"
             report += f"- Timestamp: {entry['timestamp']}\n"
             report += f"- Duration: {entry['duration_ms']:.0f}ms\n"
             
+            if entry.get("lm_usage"):
+                usage = entry["lm_usage"]
+                report += (f"- LM: {usage['calls']} calls, {usage['total_tokens']} tokens, "
+                           f"{usage['latency_ms']['total']:.0f}ms\n")
+            
             if "parsing" in entry["intermediate"]:
                 params = entry["intermediate"]["parsing"]["parsed_params"]
                 report += f"\n**Parsed Parameters:**\n"
@@ -274,7 +379,7 @@ Generated: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
                 report += f"\n**Results:**\n"
                 report += f"- Bankruptcy Probability: {entry['output']['bankruptcy_probability']:.2f}%\n"
                 report += f"- Meets Goal: {'Yes' if entry['output']['meets_goal'] else 'No'}\n"
-                report += f"- Mean End Balance: TWD {entry['output']['final_balance_mean']:,.0f}\n"
+                report += f"- Mean End Balance: TWD {_mean_end_balance(entry['output']):,.0f}\n"
             
             if entry["errors"]:
                 report += f"\n**Errors:**\n"
@@ -288,6 +393,59 @@ Generated: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         return report
 
 
+def summarize_lm_calls(calls: list) -> Dict[str, Any]:
+    """Aggregate LM call records: totals, latency percentiles, and breakdowns by model, signature and step"""
+    def totals(group):
+        latencies = sorted(c["latency_ms"] for c in group)
+        return {
+            "calls": len(group),
+            "errors": sum(1 for c in group if c.get("error")),
+            "retries": sum(c.get("retries") or 0 for c in group),
+            "cache_hits": sum(1 for c in group if c.get("cache_hit")),
+            "prompt_tokens": sum(c.get("prompt_tokens") or 0 for c in group),
+            "completion_tokens": sum(c.get("completion_tokens") or 0 for c in group),
+            "total_tokens": sum((c.get("prompt_tokens") or 0) + (c.get("completion_tokens") or 0) for c in group),
+            "cost": sum(c.get("cost") or 0 for c in group),
+            "latency_ms": {
+                "total": sum(latencies),
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0
+            }
+        }
+    
+    summary = totals(calls)
+    for key in ("model", "signature", "step"):
+        groups = {}
+        for call in calls:
+            groups.setdefault(str(call.get(key)), []).append(call)
+        summary[f"by_{key}"] = {name: totals(group) for name, group in groups.items()}
+    return summary
+
+
+def summarize_cascade(outcomes: list) -> Dict[str, Any]:
+    """Per-tier attempts, acceptances, hit rate (accepted / attempts) and share of all parses, from cascade outcomes"""
+    tiers = {}
+    for outcome in outcomes:
+        for name in outcome["attempts"]:
+            stats = tiers.setdefault(name, {"attempts": 0, "accepted": 0})
+            stats["attempts"] += 1
+            stats["accepted"] += name == outcome["tier"]
+    for stats in tiers.values():
+        stats["hit_rate"] = stats["accepted"] / stats["attempts"]
+        stats["share"] = stats["accepted"] / len(outcomes)
+    return {
+        "parses": len(outcomes),
+        "rejected": sum(1 for outcome in outcomes if outcome["tier"] is None),
+        "tiers": tiers
+    }
+
+
+def _mean_end_balance(output: Dict[str, Any]) -> Optional[float]:
+    """Mean final balance of an output entry (older logs used "final_balance_mean")"""
+    return output.get("mean_end_balance", output.get("final_balance_mean"))
+
+
 # Global logger instance
 _logger = None
 
@@ -0,0 +1,135 @@
+"""
+Registry of compiled dspy programs: versioned files keyed by signature hash, loaded instead of recompiling
+"""
+import datetime
+import hashlib
+import json
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import dspy
+
+from utils.lm_cache import signature_spec
+
+# Default registry root: programs/ at the repository root, whatever the working directory
+PROGRAMS_DIR = Path(__file__).resolve().parent.parent / "programs"
+
+
+def program_hash(program: dspy.Module) -> str:
+    """SHA-256 of a program's structure: module class, predictor names and their signatures."""
+    structure = [type(program).__name__] + [
+        [name, signature_spec(predictor.signature)] for name, predictor in program.named_predictors()
+    ]
+    payload = json.dumps(structure, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ProgramRegistry:
+    """Compiled programs (demos, instructions) saved as versioned JSON files under ``root/<name>/``.
+    
+    Each file records the hash of the program it was compiled for (see
+    program_hash). Loading hashes the freshly constructed, uncompiled program
+    and only accepts a file with the same hash, so a program compiled
+    before a signature change (field added, description or instructions
+    edited) is detected as stale instead of silently loaded. Versions are
+    never overwritten; several processes may save concurrently.
+    
+    Usage:
+        registry = ProgramRegistry()
+        advisor = registry.get_or_compile("financial_advisor", FinancialAdvisor(),
+                                          lambda program: optimizer.compile(program, trainset=trainset))
+    """
+    
+    def __init__(self, root: str = str(PROGRAMS_DIR)):
+        self.root = Path(root)
+    
+    def versions(self, name: str) -> List[Dict[str, Any]]:
+        """Metadata of every saved version of name, oldest first, each with its "path"."""
+        versions = []
+        for path in sorted((self.root / name).glob("v*.json")):
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)["meta"]
+            versions.append({**meta, "path": str(path)})
+        return sorted(versions, key=lambda meta: meta["version"])
+    
+    def save(self, name: str, program: dspy.Module, signature_hash: Optional[str] = None,
+             metadata: Optional[Dict[str, Any]] = None) -> Path:
+        """
+        Save a compiled program as the next version of name.
+        
+        Parameters:
+        -----------
+        name : str
+            Registry name, e.g. "query_parser"
+        program : dspy.Module
+            The compiled program
+        signature_hash : str, optional
+            program_hash of the uncompiled program it came from, which keys
+            the file; needed when the optimizer rewrote instructions (by
+            default the compiled program is hashed, which is right for
+            few-shot optimizers)
+        metadata : dict, optional
+            Anything worth keeping with it (optimizer, scores, trainset size)
+        
+        Returns:
+        --------
+        Path
+            The new file
+        """
+        directory = self.root / name
+        directory.mkdir(parents=True, exist_ok=True)
+        signature_hash = signature_hash or program_hash(program)
+        state = program.dump_state()
+        version = max((meta["version"] for meta in self.versions(name)), default=0) + 1
+        while True:
+            path = directory / f"v{version:03d}-{signature_hash[:12]}.json"
+            meta = {
+                "name": name,
+                "version": version,
+                "signature_hash": signature_hash,
+                "program": type(program).__name__,
+                "created": datetime.datetime.now().isoformat(),
+                "dspy_version": getattr(dspy, "__version__", None),
+                "metadata": metadata or {}
+            }
+            try:
+                # "x" mode: a concurrent save that took this version makes us take the next
+                with open(path, "x", encoding="utf-8") as f:
+                    json.dump({"meta": meta, "state": state}, f, ensure_ascii=False, indent=2, default=str)
+                return path
+            except FileExistsError:
+                version += 1
+    
+    def load(self, name: str, program: dspy.Module, version: Optional[int] = None) -> Optional[dspy.Module]:
+        """
+        Load the newest (or the given) version of name compiled for this program.
+        
+        ``program`` is the freshly constructed, uncompiled program; its state is
+        replaced in place and it is returned. Returns None when there is no
+        saved version, or when the saved versions were compiled for a
+        different signature (a warning names the stale file).
+        """
+        signature_hash = program_hash(program)
+        versions = [meta for meta in self.versions(name) if version is None or meta["version"] == version]
+        matching = [meta for meta in versions if meta["signature_hash"] == signature_hash]
+        if not matching:
+            if versions:
+                warnings.warn(f"Compiled program {versions[-1]['path']} is stale: its signature hash "
+                              f"{versions[-1]['signature_hash'][:12]} does not match {signature_hash[:12]}; recompile it")
+            return None
+        with open(matching[-1]["path"], encoding="utf-8") as f:
+            program.load_state(json.load(f)["state"])
+        return program
+    
+    def get_or_compile(self, name: str, program: dspy.Module, compile_fn: Callable[[dspy.Module], dspy.Module],
+                       metadata: Optional[Dict[str, Any]] = None) -> dspy.Module:
+        """Load name for program if a current version exists, else compile it with compile_fn and save it."""
+        base_hash = program_hash(program)
+        loaded = self.load(name, program)
+        if loaded is not None:
+            return loaded
+        compiled = compile_fn(program)
+        # Keyed by the program callers construct, even if the optimizer rewrote instructions
+        self.save(name, compiled, signature_hash=base_hash, metadata=metadata)
+        return compiled